@@ -0,0 +1,89 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from aiohttp import web
+
+BOT_USER = {"id": 42, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+# Локальная замена api.telegram.org: отвечает правдоподобными объектами, ничего не отправляет.
+# Bot направляется сюда через TelegramAPIServer.from_base(server.url)
+class FakeBotAPI:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+        self._links = itertools.count(1)
+        self._runner = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def _message(self, params):
+        chat_id = int(params.get("chat_id", 0))
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "channel"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+    def _invite_link(self, params, revoked=False):
+        link = params.get("invite_link") or f"https://t.me/+bench{next(self._links)}"
+        result = {
+            "invite_link": link,
+            "creator": BOT_USER,
+            "creates_join_request": False,
+            "is_primary": False,
+            "is_revoked": revoked,
+            "member_limit": 1,
+        }
+        if params.get("expire_date"):
+            result["expire_date"] = int(params["expire_date"])
+        return result
+
+    def _result(self, method, params):
+        if method in ("sendMessage", "sendDocument", "copyMessage", "forwardMessage"):
+            return self._message(params)
+        if method == "createChatInviteLink":
+            return self._invite_link(params)
+        if method == "revokeChatInviteLink":
+            return self._invite_link(params, revoked=True)
+        if method == "getMe":
+            return BOT_USER
+        if method == "getChatMember":
+            user_id = int(params.get("user_id", 0))
+            return {"status": "member", "user": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}}
+        # editMessageText, answerCallbackQuery, banChatMember, deleteWebhook и прочие
+        return True
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = {key: value for key, value in (await request.post()).items() if isinstance(value, str)}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.Response(text=json.dumps({"ok": True, "result": self._result(method, params)}),
+                            content_type="application/json")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
@@ -0,0 +1,313 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+# Конфиг читается при импорте модулей бота, поэтому окружение задаём до них
+ADMIN_ID = 1
+os.environ.update({
+    "BOT_TOKEN": "42:BENCH",
+    "ADMIN_IDS": str(ADMIN_ID),
+    "CHANNEL_ID": "-1001",
+    "METRICS_PORT": "0",
+    "SLOW_LOG_MS": "0",
+})
+
+from aiogram import Bot
+from aiogram.client.bot import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Update
+import broadcast
+import database
+import metrics
+from bot import create_dispatcher
+from middlewares import throttling
+from outbound import OutboundScheduler, outbound_scheduler
+from ratelimit import BucketMap
+from storage import SQLiteStorage
+from bench.fake_api import FakeBotAPI
+
+FIRST_TG_ID = 1_000_000
+SEED_BATCH = 5000
+UNLIMITED = 10 ** 6
+# Показатели, для которых больше — лучше; остальные (время) должны уменьшаться
+HIGHER_IS_BETTER = ("updates_per_sec", "per_sec")
+# По отдельным шагам выборка мала и p99 шумит, поэтому регрессией считаем только сводные показатели
+GATED = {
+    "updates_per_sec", "latency_ms.all.p50", "latency_ms.all.p99", "db.ms_per_update",
+    "admin_stats_ms.p50", "broadcast.per_sec",
+}
+
+
+async def seed(count, active_share=0.6):
+    # Пользователи tg_id = FIRST_TG_ID + i; у части — подписки с концом от -30 до +60 дней
+    rng = random.Random(1)
+    today = date.today()
+    async with database._write() as db:
+        for offset in range(0, count, SEED_BATCH):
+            users, subs = [], []
+            for i in range(offset + 1, min(offset + SEED_BATCH, count) + 1):
+                phone = f"+7900{i:07d}"
+                users.append((i, FIRST_TG_ID + i, f"User {i}", phone, f"user{i}@example.com", database.phone_digits(phone)))
+                if rng.random() < active_share:
+                    end = today + timedelta(days=rng.randint(-30, 60))
+                    months = rng.choice((1, 3, 12))
+                    subs.append((i, (end - timedelta(days=30 * months)).isoformat(), end.isoformat(), int(end >= today)))
+            await db.executemany(
+                "INSERT INTO users (id, tg_id, name, phone, email, phone_digits) VALUES (?, ?, ?, ?, ?, ?)", users
+            )
+            await db.executemany(
+                "INSERT INTO subscriptions (user_id, start_date, end_date, active) VALUES (?, ?, ?, ?)", subs
+            )
+
+
+async def active_subscribers(limit):
+    async with database._read() as db:
+        async with db.execute(
+            "SELECT u.tg_id FROM users u JOIN subscriptions s ON s.user_id = u.id "
+            "WHERE s.active = 1 AND s.end_date >= ? ORDER BY u.id LIMIT ?",
+            (date.today().isoformat(), limit)
+        ) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+
+_update_ids = itertools.count(1)
+
+
+def _user(tg_id):
+    return {"id": tg_id, "is_bot": False, "first_name": f"User{tg_id}"}
+
+
+def message_update(tg_id, text):
+    return Update.model_validate({
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_update_ids),
+            "date": int(time.time()),
+            "chat": {"id": tg_id, "type": "private"},
+            "from": _user(tg_id),
+            "text": text,
+        },
+    })
+
+
+def callback_update(tg_id, data):
+    return Update.model_validate({
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(tg_id),
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": tg_id, "type": "private"},
+                "text": "bench",
+            },
+        },
+    })
+
+
+def scenario(tg_id):
+    # (шаг, обновление) — путь нового покупателя от /start до инвайт-ссылки
+    return [
+        ("start", message_update(tg_id, "/start")),
+        ("registration", message_update(tg_id, "/registration")),
+        ("phone", message_update(tg_id, f"+7987{tg_id % 10 ** 7:07d}")),
+        ("email", message_update(tg_id, f"bench{tg_id}@example.com")),
+        ("info", message_update(tg_id, "/info")),
+        ("buy", message_update(tg_id, "/buy")),
+        ("tariff", callback_update(tg_id, "tariff_1")),
+        ("paid", callback_update(tg_id, "paid_1")),
+        ("invite", message_update(tg_id, "/invite")),
+    ]
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    pick = lambda q: round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+    return {"p50": pick(0.5), "p99": pick(0.99), "max": round(samples[-1] * 1000, 3), "count": len(samples)}
+
+
+def db_totals():
+    totals = metrics.db_latency.totals()
+    return sum(count for count, _ in totals.values()), sum(total for _, total in totals.values())
+
+
+async def replay(dp, bot, tg_ids):
+    latencies = {}
+
+    async def run_user(tg_id):
+        # Обновления одного пользователя идут по порядку, как при обычном polling
+        for step, update in scenario(tg_id):
+            started = time.perf_counter()
+            await dp.feed_update(bot, update)
+            latencies.setdefault(step, []).append(time.perf_counter() - started)
+
+    calls_before, db_before = db_totals()
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(tg_id) for tg_id in tg_ids))
+    wall = time.perf_counter() - started
+    calls_after, db_after = db_totals()
+    updates = sum(len(samples) for samples in latencies.values())
+    return {
+        "updates": updates,
+        "wall_seconds": round(wall, 3),
+        "updates_per_sec": round(updates / wall, 1),
+        "latency_ms": {
+            "all": percentiles([s for samples in latencies.values() for s in samples]),
+            **{step: percentiles(samples) for step, samples in latencies.items()},
+        },
+        "db": {
+            "calls": calls_after - calls_before,
+            "seconds": round(db_after - db_before, 3),
+            # Сумма времени всех вызовов, включая ожидание соединения; при конкуренции больше wall_seconds
+            "ms_per_update": round((db_after - db_before) * 1000 / updates, 3),
+        },
+    }
+
+
+async def admin_phase(dp, bot, stats_runs):
+    samples = []
+    for _ in range(stats_runs):
+        started = time.perf_counter()
+        await dp.feed_update(bot, callback_update(ADMIN_ID, "admin_stats"))
+        samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await dp.feed_update(bot, message_update(ADMIN_ID, "/send Бенчмарк рассылки"))
+    broadcast_id = max(broadcast._jobs)
+    await asyncio.gather(*list(broadcast._jobs.values()))
+    wall = time.perf_counter() - started
+    recipients = sum((await database.get_broadcast_counts(broadcast_id)).values())
+    return {
+        "admin_stats_ms": percentiles(samples),
+        "broadcast": {"recipients": recipients, "seconds": round(wall, 3), "per_sec": round(recipients / wall, 1)},
+    }
+
+
+def _flatten(report, prefix=""):
+    for key, value in report.items():
+        if key == "api_calls":
+            continue
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and key not in ("count", "max", "calls", "updates", "recipients"):
+            yield f"{prefix}{key}", value
+
+
+def compare(report, baseline, tolerance):
+    # Печатает изменения относительно baseline; возвращает список ухудшений сверх tolerance
+    current = dict(_flatten(report))
+    regressions = []
+    print(f"\n{'metric':<36}{'baseline':>12}{'current':>12}{'change':>10}")
+    for key, old in _flatten(baseline):
+        new = current.get(key)
+        if new is None or not old:
+            continue
+        change = (new - old) / old
+        worse = -change if key.endswith(HIGHER_IS_BETTER) else change
+        mark = " !" if key in GATED and worse > tolerance else ""
+        if mark:
+            regressions.append(key)
+        print(f"{key:<36}{old:>12}{new:>12}{change:>+10.1%}{mark}")
+    return regressions
+
+
+def print_report(report):
+    print(f"users: {report['users']}, seeded: {report['seeded']}, updates: {report['updates']}, "
+          f"{report['updates_per_sec']} updates/s")
+    print(f"{'step':<14}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for step, values in report["latency_ms"].items():
+        print(f"{step:<14}{values['p50']:>10}{values['p99']:>10}{values['max']:>10}")
+    db = report["db"]
+    print(f"db: {db['calls']} calls, {db['seconds']} s, {db['ms_per_update']} ms/update")
+    stats = report["admin_stats_ms"]
+    print(f"admin_stats: p50 {stats['p50']} ms, p99 {stats['p99']} ms")
+    sent = report["broadcast"]
+    print(f"broadcast: {sent['recipients']} recipients in {sent['seconds']} s ({sent['per_sec']}/s)")
+
+
+async def main(args):
+    workdir = None
+    if args.db:
+        database.DB_PATH = args.db
+        fresh = not os.path.exists(args.db)
+    else:
+        workdir = tempfile.TemporaryDirectory(prefix="bench_")
+        database.DB_PATH = os.path.join(workdir.name, "bench.db")
+        fresh = True
+    await database.init_db()
+    if fresh:
+        started = time.perf_counter()
+        await seed(args.seed)
+        print(f"seeded {args.seed} users in {time.perf_counter() - started:.1f} s")
+    async with database._read() as db:
+        async with db.execute("SELECT COUNT(*) FROM users") as cursor:
+            seeded = (await cursor.fetchone())[0]
+
+    api = FakeBotAPI(latency=args.api_latency / 1000)
+    await api.start()
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api.url))
+    if args.real_limits:
+        session.middleware(outbound_scheduler)
+    else:
+        # Без лимитов Telegram бенчмарк меряет бота, а не токен-бакеты
+        session.middleware(OutboundScheduler(UNLIMITED, UNLIMITED, UNLIMITED))
+        throttling.buckets = BucketMap(UNLIMITED, UNLIMITED)
+    session.middleware(metrics.api_metrics)
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    storage = SQLiteStorage()
+    dp = create_dispatcher(storage)
+    try:
+        report = {"users": args.users, "seeded": seeded}
+        report.update(await replay(dp, bot, await active_subscribers(args.users)))
+        report.update(await admin_phase(dp, bot, args.stats_runs))
+        report["api_calls"] = dict(api.calls)
+    finally:
+        await storage.close()
+        await bot.session.close()
+        await api.stop()
+        await database.close_db()
+        if workdir:
+            workdir.cleanup()
+
+    print_report(report)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\nregressions over {args.tolerance:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark against a fake Bot API")
+    parser.add_argument("--users", type=int, default=200, help="simulated users replaying the purchase flow")
+    parser.add_argument("--seed", type=int, default=20000, help="users to pre-seed into a fresh database")
+    parser.add_argument("--db", help="database file; reused without seeding if it already exists")
+    parser.add_argument("--stats-runs", type=int, default=20, help="admin_stats calls to time")
+    parser.add_argument("--api-latency", type=float, default=0, help="fake Bot API response delay, ms")
+    parser.add_argument("--real-limits", action="store_true", help="keep production rate limits and throttling")
+    parser.add_argument("--save", help="write the JSON report to this file")
+    parser.add_argument("--baseline", help="compare with a previously saved report")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed slowdown before failing, 0.1 = 10%%")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -1,18 +1,69 @@
 import asyncio
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN
-from aiogram.client.bot import DefaultBotProperties 
-from database import init_db
+from config import BOT_TOKEN, BOT_MODE
+from aiogram.client.bot import DefaultBotProperties
+from database import init_db, close_db, cache_stats
+from broadcast import resume_broadcasts, stop_broadcasts
+from scheduler import run_expiry_scheduler
+from invites import run_invite_pool
+from reconcile import run_reconcile_scheduler, stop_reconcile
+from webhook import run_webhook
+from storage import SQLiteStorage
+from outbound import outbound_scheduler
+from middlewares import throttling
+from metrics import HandlerMetricsMiddleware, api_metrics, gauge, start_metrics_server
 from handlers import user, admin
 
+def register_gauges():
+    gauge("bot_outbound_queue_depth", "Bot API requests waiting in the outbound queue", "priority", outbound_scheduler.queue_depth)
+    gauge("bot_throttling_events", "Throttling middleware decisions since start", "result", lambda: throttling.stats)
+    gauge("bot_cache_hits", "Read cache hits since start", "cache",
+          lambda: {name: stats["hits"] for name, stats in cache_stats().items()})
+    gauge("bot_cache_misses", "Read cache misses since start", "cache",
+          lambda: {name: stats["misses"] for name, stats in cache_stats().items()})
+
+def create_dispatcher(storage=None):
+    # Общая сборка для бота и бенчмарка (bench/run.py)
+    dp = Dispatcher(storage=storage or SQLiteStorage())
+    dp.message.outer_middleware(throttling)
+    dp.callback_query.outer_middleware(throttling)
+    # Внутренние middleware диспетчера наследуются вложенными роутерами
+    dp.message.middleware(HandlerMetricsMiddleware("message"))
+    dp.callback_query.middleware(HandlerMetricsMiddleware("callback_query"))
+    dp.include_router(user.router)
+    dp.include_router(admin.router)
+    return dp
+
 async def main():
     await init_db()
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-    dp = Dispatcher(storage=MemoryStorage())
-    dp.include_router(user.router)
-    dp.include_router(admin.router)
-    await dp.start_polling(bot)
+    bot.session.middleware(outbound_scheduler)
+    bot.session.middleware(api_metrics)
+    dp = create_dispatcher()
+    register_gauges()
+    metrics_runner = await start_metrics_server()
+    await resume_broadcasts(bot)
+    tasks = [
+        asyncio.create_task(run_expiry_scheduler(bot)),
+        asyncio.create_task(run_invite_pool(bot)),
+        asyncio.create_task(run_reconcile_scheduler(bot)),
+    ]
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # После работы в режиме webhook getUpdates вернёт Conflict, пока вебхук не снят
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await stop_broadcasts()
+        await stop_reconcile()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await close_db()
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+from database import (
+    create_broadcast, set_broadcast_message, get_running_broadcasts, get_broadcast_recipients,
+    get_broadcast_counts, update_broadcast_recipients, finish_broadcast,
+)
+from outbound import BULK, set_priority
+
+WORKERS = 8
+FETCH_SIZE = 500
+FLUSH_SIZE = 100
+PROGRESS_INTERVAL = 5
+
+logger = logging.getLogger(__name__)
+
+_jobs = {}
+
+
+def _progress_text(broadcast_id, counts, done=False):
+    title = "завершена" if done else "идёт"
+    return (
+        f"<b>📢 Рассылка #{broadcast_id} {title}</b>\n\n"
+        f"✅ Доставлено: <b>{counts.get('sent', 0)}</b>\n"
+        f"🚫 Заблокировали бота: <b>{counts.get('blocked', 0)}</b>\n"
+        f"⚠️ Ошибки: <b>{counts.get('failed', 0)}</b>\n"
+        f"⏳ Осталось: <b>{counts.get('pending', 0)}</b>"
+    )
+
+
+async def _show_progress(bot, admin_id, message_id, broadcast_id, counts, done=False):
+    if not message_id:
+        return
+    try:
+        await bot.edit_message_text(
+            _progress_text(broadcast_id, counts, done), chat_id=admin_id, message_id=message_id
+        )
+    except TelegramAPIError:
+        # "message is not modified" и прочее не должно останавливать рассылку
+        pass
+
+
+async def _deliver(bot, chat_id, text):
+    # Лимиты и повторы при RetryAfter/сетевых ошибках — в outbound.outbound_scheduler
+    try:
+        await bot.send_message(chat_id, text)
+        return "sent"
+    except TelegramForbiddenError:
+        return "blocked"
+    except TelegramAPIError:
+        return "failed"
+
+
+async def _run(bot, broadcast_id, admin_id, text, message_id):
+    set_priority(BULK)
+    counts = await get_broadcast_counts(broadcast_id)
+    queue = asyncio.Queue(maxsize=WORKERS * 2)
+    results = []
+
+    async def flush():
+        if results:
+            batch = results[:]
+            results.clear()
+            await update_broadcast_recipients(broadcast_id, batch)
+
+    async def worker():
+        while True:
+            tg_id = await queue.get()
+            try:
+                status = await _deliver(bot, tg_id, text)
+            except Exception:
+                logger.exception("Broadcast %s: failed to deliver to %s", broadcast_id, tg_id)
+                status = "failed"
+            counts[status] = counts.get(status, 0) + 1
+            counts["pending"] = counts.get("pending", 0) - 1
+            results.append((tg_id, status))
+            if len(results) >= FLUSH_SIZE:
+                await flush()
+            queue.task_done()
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            await flush()
+            await _show_progress(bot, admin_id, message_id, broadcast_id, counts)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(WORKERS)]
+    tasks.append(asyncio.create_task(reporter()))
+    try:
+        after = 0
+        while batch := await get_broadcast_recipients(broadcast_id, after, FETCH_SIZE):
+            for tg_id in batch:
+                await queue.put(tg_id)
+            after = batch[-1]
+        await queue.join()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Сохраняем результаты и при остановке бота, чтобы продолжить с того же места
+        await flush()
+    await finish_broadcast(broadcast_id)
+    await _show_progress(bot, admin_id, message_id, broadcast_id, counts, done=True)
+
+
+def _spawn(bot, broadcast_id, admin_id, text, message_id):
+    task = asyncio.create_task(_run(bot, broadcast_id, admin_id, text, message_id))
+    _jobs[broadcast_id] = task
+    task.add_done_callback(lambda _: _jobs.pop(broadcast_id, None))
+
+
+async def start_broadcast(bot, admin_id, text):
+    broadcast_id, total = await create_broadcast(admin_id, text)
+    message = await bot.send_message(admin_id, _progress_text(broadcast_id, {"pending": total}))
+    await set_broadcast_message(broadcast_id, message.message_id)
+    _spawn(bot, broadcast_id, admin_id, text, message.message_id)
+    return broadcast_id
+
+
+async def resume_broadcasts(bot):
+    for broadcast_id, admin_id, text, message_id in await get_running_broadcasts():
+        _spawn(bot, broadcast_id, admin_id, text, message_id)
+
+
+async def stop_broadcasts():
+    tasks = list(_jobs.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
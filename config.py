@@ -5,4 +5,26 @@ load_dotenv()
  
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x]
-CHANNEL_ID = os.getenv("CHANNEL_ID")  # ID закрытого канала 
\ No newline at end of file
+CHANNEL_ID = os.getenv("CHANNEL_ID")  # ID закрытого канала
+REMINDER_DAYS = int(os.getenv("REMINDER_DAYS", "3"))  # за сколько дней напоминать об окончании подписки
+# Тарифы: ключ уходит в callback_data (tariff_<ключ>, paid_<ключ>) и сохраняется в заявках и подписках
+TARIFFS = {
+    "1": {"months": 1, "price": 200, "title": "1 месяц"},
+    "3": {"months": 3, "price": 500, "title": "3 месяца"},
+    "12": {"months": 12, "price": 1500, "title": "12 месяцев"},
+}
+RECONCILE_INTERVAL_HOURS = int(os.getenv("RECONCILE_INTERVAL_HOURS", "24"))  # как часто сверять участников канала с подписками
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный https-адрес; пусто — set_webhook не вызывается
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+WEBHOOK_MAX_INFLIGHT = int(os.getenv("WEBHOOK_MAX_INFLIGHT", "100"))
+
+# Метрики Prometheus на отдельном локальном порту; 0 — сервер не запускается
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+SLOW_LOG_MS = int(os.getenv("SLOW_LOG_MS", "0"))  # порог для лога медленных хендлеров/запросов; 0 — выключен
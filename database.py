@@ -1,81 +1,1000 @@
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import date, timedelta
 import aiosqlite
+from metrics import db_lock_wait, timed_query
 
 DB_PATH = "bot.db"
+READ_POOL_SIZE = 4
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+)
+
+CACHE_SIZE = 10000
+CACHE_TTL = 60
+
+
+def phone_digits(phone):
+    return re.sub(r"\D", "", phone or "")
+
+
+_MISSING = object()
+
+
+# LRU с TTL для горячих чтений. version растёт при каждой инвалидации: чтение,
+# начатое до записи, не положит в кэш устаревшую строку
+class _TTLCache:
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is not None and item[0] > time.monotonic():
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+        self.misses += 1
+        return _MISSING
+
+    def set(self, key, value, version):
+        if version != self.version:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self.version += 1
+        self._data.pop(key, None)
+
+
+_users_cache = _TTLCache()
+_subscriptions_cache = _TTLCache()
+
+
+def cache_stats():
+    return {
+        name: {"size": len(cache._data), "hits": cache.hits, "misses": cache.misses}
+        for name, cache in (("users", _users_cache), ("subscriptions", _subscriptions_cache))
+    }
+
+
+# Один писатель и пул читателей, открываются в init_db и живут до close_db
+_writer = None
+_write_lock = asyncio.Lock()
+_readers = None
+
+
+async def _connect(readonly=False):
+    # cached_statements — кэш подготовленных запросов sqlite3 на соединение
+    db = await aiosqlite.connect(DB_PATH, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in PRAGMAS:
+        await db.execute(pragma)
+    if readonly:
+        await db.execute("PRAGMA query_only = 1")
+    return db
+
+
+@asynccontextmanager
+async def _read():
+    db = await _readers.get()
+    try:
+        yield db
+    finally:
+        _readers.put_nowait(db)
+
+
+@asynccontextmanager
+async def _write():
+    started = time.perf_counter()
+    async with _write_lock:
+        db_lock_wait.observe(time.perf_counter() - started)
+        try:
+            yield _writer
+        except BaseException:
+            await _writer.rollback()
+            raise
+        await _writer.commit()
+
+
+async def _columns(db, table):
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        return {row[1] async for row in cursor}
+
+
+def _analytics_upsert(columns):
+    return "ON CONFLICT (day) DO UPDATE SET " + ", ".join(f"{column} = {column} + excluded.{column}" for column in columns)
+
+
+async def _bump_analytics(db, day=None, **deltas):
+    # Приращения дневных итогов; вызывается внутри транзакции, которая меняет сами данные
+    deltas = {column: value for column, value in deltas.items() if value}
+    if not deltas:
+        return
+    await db.execute(
+        f"INSERT INTO analytics_daily (day, {', '.join(deltas)}) VALUES (?{', ?' * len(deltas)}) "
+        + _analytics_upsert(deltas),
+        ((day or date.today()).isoformat(), *deltas.values())
+    )
+
+
+async def _migration_1(db):
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        tg_id INTEGER UNIQUE,
+        name TEXT,
+        phone TEXT,
+        email TEXT,
+        is_admin INTEGER DEFAULT 0
+    )""")
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        start_date TEXT,
+        end_date TEXT,
+        active INTEGER DEFAULT 1
+    )""")
+
+
+async def _migration_2(db):
+    # invite_link писался add_invite_link, но init_db его не создавал
+    if "invite_link" not in await _columns(db, "subscriptions"):
+        await db.execute("ALTER TABLE subscriptions ADD COLUMN invite_link TEXT")
+    # ДД.ММ.ГГГГ -> ГГГГ-ММ-ДД, чтобы даты сравнивались и сортировались в SQL
+    for column in ("start_date", "end_date"):
+        await db.execute(
+            f"UPDATE subscriptions SET {column} = "
+            f"substr({column}, 7, 4) || '-' || substr({column}, 4, 2) || '-' || substr({column}, 1, 2) "
+            f"WHERE {column} LIKE '__.__.____'"
+        )
+    # users(tg_id) уже проиндексирован ограничением UNIQUE
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions (user_id, active, end_date)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_active_end ON subscriptions (active, end_date)")
+
+
+async def _migration_3(db):
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY,
+        admin_id INTEGER,
+        text TEXT,
+        status TEXT DEFAULT 'running',
+        progress_message_id INTEGER,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        finished_at TEXT
+    )""")
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS broadcast_recipients (
+        broadcast_id INTEGER,
+        tg_id INTEGER,
+        status TEXT DEFAULT 'pending',
+        PRIMARY KEY (broadcast_id, tg_id)
+    ) WITHOUT ROWID""")
+
+
+async def _migration_4(db):
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS admin_settings (
+        tg_id INTEGER PRIMARY KEY,
+        page_size INTEGER
+    )""")
+
+
+async def _migration_5(db):
+    # Полнотекстовый индекс для /find; trigram даёт поиск по подстроке в имени, email и цифрах телефона
+    if "phone_digits" not in await _columns(db, "users"):
+        await db.execute("ALTER TABLE users ADD COLUMN phone_digits TEXT")
+    async with db.execute("SELECT id, phone FROM users") as cursor:
+        rows = [(phone_digits(phone), user_id) async for user_id, phone in cursor]
+    await db.executemany("UPDATE users SET phone_digits = ? WHERE id = ?", rows)
+    await db.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        name, email, phone_digits,
+        content='users', content_rowid='id', tokenize='trigram'
+    )""")
+    await db.execute("""
+    CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts (rowid, name, email, phone_digits)
+        VALUES (new.id, new.name, new.email, new.phone_digits);
+    END""")
+    await db.execute("""
+    CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, name, email, phone_digits)
+        VALUES ('delete', old.id, old.name, old.email, old.phone_digits);
+    END""")
+    await db.execute("""
+    CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF name, email, phone_digits ON users BEGIN
+        INSERT INTO users_fts (users_fts, rowid, name, email, phone_digits)
+        VALUES ('delete', old.id, old.name, old.email, old.phone_digits);
+        INSERT INTO users_fts (rowid, name, email, phone_digits)
+        VALUES (new.id, new.name, new.email, new.phone_digits);
+    END""")
+    await db.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+
+async def _migration_6(db):
+    if "reminded" not in await _columns(db, "subscriptions"):
+        await db.execute("ALTER TABLE subscriptions ADD COLUMN reminded INTEGER DEFAULT 0")
+
+
+async def _migration_7(db):
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS fsm_storage (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        updated_at INTEGER
+    ) WITHOUT ROWID""")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated ON fsm_storage (updated_at)")
+
+
+async def _migration_8(db):
+    # Пул заранее созданных ссылок: user_id IS NULL — ещё не выдана
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS invite_links (
+        id INTEGER PRIMARY KEY,
+        link TEXT UNIQUE,
+        expire_at INTEGER,
+        user_id INTEGER,
+        issued_at INTEGER,
+        revoked INTEGER DEFAULT 0
+    )""")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_invite_links_user ON invite_links (user_id, expire_at)")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_invite_links_pool ON invite_links (expire_at) "
+        "WHERE user_id IS NULL AND revoked = 0"
+    )
+
+
+async def _migration_9(db):
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS payment_requests (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        tariff TEXT,
+        months INTEGER,
+        status TEXT DEFAULT 'pending',
+        created_at INTEGER,
+        decided_at INTEGER,
+        decided_by INTEGER
+    )""")
+    # Не больше одной открытой заявки на пользователя и тариф
+    await db.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_payment_requests_open ON payment_requests (user_id, tariff) "
+        "WHERE status = 'pending'"
+    )
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_payment_requests_status ON payment_requests (status, id)")
+
+
+async def _migration_10(db):
+    # Сверка участников канала с подписками; cursor_user_id — докуда дошли, чтобы продолжить после рестарта
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS reconcile_runs (
+        id INTEGER PRIMARY KEY,
+        started_by INTEGER,
+        status TEXT DEFAULT 'running',
+        cursor_user_id INTEGER DEFAULT 0,
+        checked INTEGER DEFAULT 0,
+        removed INTEGER DEFAULT 0,
+        not_joined INTEGER DEFAULT 0,
+        errors INTEGER DEFAULT 0,
+        started_at INTEGER,
+        finished_at INTEGER
+    )""")
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS reconcile_findings (
+        run_id INTEGER,
+        tg_id INTEGER,
+        kind TEXT
+    )""")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_reconcile_findings_run ON reconcile_findings (run_id, kind)")
+
+
+async def _migration_11(db):
+    # Тариф и цена продажи; у подписок, созданных до этой миграции, tariff и price остаются NULL
+    for column in ("tariff TEXT", "price INTEGER"):
+        await db.execute(f"ALTER TABLE subscriptions ADD COLUMN {column}")
+    await db.execute("ALTER TABLE payment_requests ADD COLUMN price INTEGER")
+    # Дневные итоги, которые обновляются в тех же транзакциях, что и сами события
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS analytics_daily (
+        day TEXT PRIMARY KEY,
+        revenue INTEGER DEFAULT 0,
+        new_subs INTEGER DEFAULT 0,
+        renewals INTEGER DEFAULT 0,
+        churned INTEGER DEFAULT 0,
+        payment_requests INTEGER DEFAULT 0,
+        payments_approved INTEGER DEFAULT 0
+    )""")
+    # Заполняем по истории; выручку восстановить не из чего — цены раньше не сохранялись
+    await db.execute("""
+    INSERT INTO analytics_daily (day, new_subs, renewals)
+    SELECT start_date, SUM(n = 1), SUM(n > 1) FROM (
+        SELECT start_date, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY id) AS n FROM subscriptions
+    ) GROUP BY start_date""")
+    await db.execute(f"""
+    INSERT INTO analytics_daily (day, churned)
+    SELECT date(s.end_date, '+1 day') AS day, COUNT(*) FROM subscriptions s
+    WHERE s.active = 0 AND s.end_date < date('now', 'localtime')
+      AND s.id = (SELECT MAX(id) FROM subscriptions WHERE user_id = s.user_id)
+    GROUP BY day
+    {_analytics_upsert(("churned",))}""")
+    await db.execute(f"""
+    INSERT INTO analytics_daily (day, payment_requests, payments_approved)
+    SELECT date(created_at, 'unixepoch', 'localtime') AS day, COUNT(*), SUM(status = 'approved')
+    FROM payment_requests GROUP BY day
+    {_analytics_upsert(("payment_requests", "payments_approved"))}""")
+
+
+async def _migration_12(db):
+    # Ссылки живут в invite_links (миграция 8), колонка subscriptions.invite_link больше не пишется
+    if "invite_link" in await _columns(db, "subscriptions"):
+        await db.execute("ALTER TABLE subscriptions DROP COLUMN invite_link")
+
+
+# Версия схемы = номер миграции; новые миграции только дописываются в конец
+MIGRATIONS = [
+    _migration_1, _migration_2, _migration_3, _migration_4, _migration_5, _migration_6, _migration_7,
+    _migration_8, _migration_9, _migration_10, _migration_11, _migration_12,
+]
+
+
+async def _migrate():
+    async with _write() as db:
+        await db.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        async with db.execute("SELECT MAX(version) FROM schema_version") as cursor:
+            current = (await cursor.fetchone())[0] or 0
+    for version, migration in enumerate(MIGRATIONS[current:], start=current + 1):
+        async with _write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            await migration(db)
+            await db.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+
 
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY,
-            tg_id INTEGER UNIQUE,
-            name TEXT,
-            phone TEXT,
-            email TEXT,
-            is_admin INTEGER DEFAULT 0
-        )""")
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS subscriptions (
-            id INTEGER PRIMARY KEY,
-            user_id INTEGER,
-            start_date TEXT,
-            end_date TEXT,
-            active INTEGER DEFAULT 1
-        )""")
-        await db.commit()
+    global _writer, _readers
+    if _writer is not None:
+        return
+    _writer = await _connect()
+    await _writer.execute("PRAGMA journal_mode = WAL")
+    await _migrate()
+    _readers = asyncio.Queue()
+    for _ in range(READ_POOL_SIZE):
+        _readers.put_nowait(await _connect(readonly=True))
+
+
+async def close_db():
+    global _writer, _readers
+    if _readers is not None:
+        while not _readers.empty():
+            await _readers.get_nowait().close()
+        _readers = None
+    if _writer is not None:
+        async with _write_lock:
+            await _writer.execute("PRAGMA optimize")
+            await _writer.close()
+        _writer = None
 
+
+@timed_query
 async def get_user(tg_id):
-    async with aiosqlite.connect(DB_PATH) as db:
+    user = _users_cache.get(tg_id)
+    if user is not _MISSING:
+        return user
+    version = _users_cache.version
+    async with _read() as db:
         async with db.execute("SELECT * FROM users WHERE tg_id = ?", (tg_id,)) as cursor:
-            return await cursor.fetchone()
+            user = await cursor.fetchone()
+    _users_cache.set(tg_id, user, version)
+    return user
 
+@timed_query
 async def add_user(tg_id, name, phone, email, is_admin=0):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write() as db:
         await db.execute(
-            "INSERT OR IGNORE INTO users (tg_id, name, phone, email, is_admin) VALUES (?, ?, ?, ?, ?)",
-            (tg_id, name, phone, email, is_admin)
+            "INSERT OR IGNORE INTO users (tg_id, name, phone, email, is_admin, phone_digits) VALUES (?, ?, ?, ?, ?, ?)",
+            (tg_id, name, phone, email, is_admin, phone_digits(phone))
         )
-        await db.commit()
+    _users_cache.invalidate(tg_id)
 
+@timed_query
 async def update_user_email(tg_id, email):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write() as db:
         await db.execute("UPDATE users SET email = ? WHERE tg_id = ?", (email, tg_id))
-        await db.commit()
+    _users_cache.invalidate(tg_id)
 
+@timed_query
 async def update_user_phone(tg_id, phone):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE users SET phone = ? WHERE tg_id = ?", (phone, tg_id))
-        await db.commit()
+    async with _write() as db:
+        await db.execute(
+            "UPDATE users SET phone = ?, phone_digits = ? WHERE tg_id = ?", (phone, phone_digits(phone), tg_id)
+        )
+    _users_cache.invalidate(tg_id)
 
+@timed_query
 async def get_subscription(user_id):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT * FROM subscriptions WHERE user_id = ? AND active = 1", (user_id,)) as cursor:
-            return await cursor.fetchone()
+    sub = _subscriptions_cache.get(user_id)
+    if sub is not _MISSING:
+        return sub
+    version = _subscriptions_cache.version
+    async with _read() as db:
+        async with db.execute(
+            "SELECT * FROM subscriptions WHERE user_id = ? AND active = 1 AND end_date >= ?",
+            (user_id, date.today().isoformat())
+        ) as cursor:
+            sub = await cursor.fetchone()
+    _subscriptions_cache.set(user_id, sub, version)
+    return sub
+
+# Подписки, выданные админом (/activate_sub, /bulk_activate), без оплаты по тарифу
+MANUAL_TARIFF = "manual"
+
+async def _activate(db, user_id, months, tariff=None, price=None):
+    start = date.today()
+    end = start + timedelta(days=30 * months)
+    async with db.execute("SELECT 1 FROM subscriptions WHERE user_id = ? LIMIT 1", (user_id,)) as cursor:
+        renewal = await cursor.fetchone() is not None
+    await db.execute("UPDATE subscriptions SET active = 0 WHERE user_id = ? AND active = 1", (user_id,))
+    await db.execute(
+        "INSERT INTO subscriptions (user_id, start_date, end_date, active, tariff, price) VALUES (?, ?, ?, 1, ?, ?)",
+        (user_id, start.isoformat(), end.isoformat(), tariff, price)
+    )
+    await _bump_analytics(db, start, revenue=price or 0, new_subs=int(not renewal), renewals=int(renewal))
+    return end
+
+@timed_query
+async def activate_subscription(user_id, months):
+    async with _write() as db:
+        end = await _activate(db, user_id, months, MANUAL_TARIFF)
+    _subscriptions_cache.invalidate(user_id)
+    return end
 
-async def add_subscription(user_id, start_date, end_date):
-    async with aiosqlite.connect(DB_PATH) as db:
+@timed_query
+async def bulk_activate_subscriptions(rows):
+    # rows: [(tg_id, months)]. Пользователи ищутся через IN (...) пачками, а продление всех —
+    # executemany в одной транзакции. Возвращает ({tg_id: end_date}, [tg_id без регистрации])
+    start = date.today()
+    users = {}
+    async with _write() as db:
+        tg_ids = [tg_id for tg_id, _ in rows]
+        for i in range(0, len(tg_ids), 500):
+            chunk = tg_ids[i:i + 500]
+            marks = ", ".join("?" * len(chunk))
+            async with db.execute(f"SELECT tg_id, id FROM users WHERE tg_id IN ({marks})", chunk) as cursor:
+                users.update({tg_id: user_id async for tg_id, user_id in cursor})
+        found = [(users[tg_id], start + timedelta(days=30 * months), tg_id) for tg_id, months in rows if tg_id in users]
+        user_ids = [user_id for user_id, _, _ in found]
+        renewed = set()
+        for i in range(0, len(user_ids), 500):
+            chunk = user_ids[i:i + 500]
+            marks = ", ".join("?" * len(chunk))
+            async with db.execute(f"SELECT DISTINCT user_id FROM subscriptions WHERE user_id IN ({marks})", chunk) as cursor:
+                renewed.update({row[0] async for row in cursor})
+        await db.executemany(
+            "UPDATE subscriptions SET active = 0 WHERE user_id = ? AND active = 1", [(user_id,) for user_id, _, _ in found]
+        )
+        await db.executemany(
+            "INSERT INTO subscriptions (user_id, start_date, end_date, active, tariff) VALUES (?, ?, ?, 1, ?)",
+            [(user_id, start.isoformat(), end.isoformat(), MANUAL_TARIFF) for user_id, end, _ in found]
+        )
+        # Повтор tg_id в файле даёт две строки одному пользователю: первая — новая подписка, дальше продления
+        new_subs = len(set(user_ids) - renewed)
+        await _bump_analytics(db, start, new_subs=new_subs, renewals=len(found) - new_subs)
+    for user_id, _, _ in found:
+        _subscriptions_cache.invalidate(user_id)
+    return {tg_id: end for _, end, tg_id in found}, [tg_id for tg_id, _ in rows if tg_id not in users]
+
+@timed_query
+async def create_payment_request(user_id, tariff, months, price=None):
+    # (id заявки, создана ли новая); повтор открытой заявки отсекает уникальный индекс
+    async with _write() as db:
+        cursor = await db.execute(
+            "INSERT OR IGNORE INTO payment_requests (user_id, tariff, months, price, created_at) VALUES (?, ?, ?, ?, ?)",
+            (user_id, tariff, months, price, int(time.time()))
+        )
+        if cursor.rowcount:
+            request_id = cursor.lastrowid
+            await _bump_analytics(db, payment_requests=1)
+            return request_id, True
+        async with db.execute(
+            "SELECT id FROM payment_requests WHERE user_id = ? AND tariff = ? AND status = 'pending'",
+            (user_id, tariff)
+        ) as cursor:
+            return (await cursor.fetchone())[0], False
+
+@timed_query
+async def decide_payment_request(request_id, admin_id, approve):
+    # Проверка статуса, продление подписки и отметка заявки — одна транзакция.
+    # Возвращает (tg_id, name, months, end_date или None) либо None, если заявка уже обработана
+    async with _write() as db:
+        async with db.execute(
+            "SELECT r.user_id, u.tg_id, u.name, r.months, r.tariff, r.price FROM payment_requests r "
+            "JOIN users u ON u.id = r.user_id WHERE r.id = ? AND r.status = 'pending'",
+            (request_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        user_id, tg_id, name, months, tariff, price = row
+        end = None
+        if approve:
+            end = await _activate(db, user_id, months, tariff, price)
+            # Конверсия считается по дню одобрения, а не по дню создания заявки
+            await _bump_analytics(db, payments_approved=1)
         await db.execute(
-            "INSERT INTO subscriptions (user_id, start_date, end_date, active) VALUES (?, ?, ?, 1)",
-            (user_id, start_date, end_date)
+            "UPDATE payment_requests SET status = ?, decided_at = ?, decided_by = ? WHERE id = ?",
+            ("approved" if approve else "rejected", int(time.time()), admin_id, request_id)
         )
-        await db.commit()
+    if approve:
+        _subscriptions_cache.invalidate(user_id)
+    return tg_id, name, months, end
+
+@timed_query
+async def get_pending_payment_requests(after_id=0, before_id=None, limit=20):
+    if before_id is None:
+        where, order, cursor_id = "r.id > ?", "ASC", after_id
+    else:
+        where, order, cursor_id = "r.id < ?", "DESC", before_id
+    async with _read() as db:
+        async with db.execute(
+            f"SELECT r.id, u.tg_id, u.name, r.months, r.created_at FROM payment_requests r "
+            f"JOIN users u ON u.id = r.user_id WHERE r.status = 'pending' AND {where} "
+            f"ORDER BY r.id {order} LIMIT ?",
+            (cursor_id, limit + 1)
+        ) as cursor:
+            rows = await cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before_id is not None:
+        rows.reverse()
+    return rows, has_more
+
+@timed_query
+async def expire_subscriptions(today):
+    # Одна транзакция: выбираем истёкшие по индексу (active, end_date) и сразу гасим их
+    async with _write() as db:
+        async with db.execute(
+            "SELECT s.id, s.user_id, u.tg_id FROM subscriptions s JOIN users u ON u.id = s.user_id "
+            "WHERE s.active = 1 AND s.end_date < ?",
+            (today.isoformat(),)
+        ) as cursor:
+            expired = await cursor.fetchall()
+        await db.executemany("UPDATE subscriptions SET active = 0 WHERE id = ?", [(row[0],) for row in expired])
+        await _bump_analytics(db, today, churned=len(expired))
+    for _, user_id, _ in expired:
+        _subscriptions_cache.invalidate(user_id)
+    return [(user_id, tg_id) for _, user_id, tg_id in expired]
+
+@timed_query
+async def get_subscriptions_to_remind(until):
+    async with _read() as db:
+        async with db.execute(
+            "SELECT s.id, u.tg_id, s.end_date FROM subscriptions s JOIN users u ON u.id = s.user_id "
+            "WHERE s.active = 1 AND s.end_date <= ? AND s.reminded = 0",
+            (until.isoformat(),)
+        ) as cursor:
+            return await cursor.fetchall()
+
+@timed_query
+async def mark_reminded(subscription_ids):
+    async with _write() as db:
+        await db.executemany("UPDATE subscriptions SET reminded = 1 WHERE id = ?", [(i,) for i in subscription_ids])
+
+@timed_query
+async def get_users_page(after_id=0, before_id=None, limit=20):
+    # Keyset-пагинация по id: цена страницы не зависит от её номера
+    if before_id is None:
+        sql, cursor_id = "SELECT * FROM users WHERE id > ? ORDER BY id LIMIT ?", after_id
+    else:
+        sql, cursor_id = "SELECT * FROM users WHERE id < ? ORDER BY id DESC LIMIT ?", before_id
+    async with _read() as db:
+        async with db.execute(sql, (cursor_id, limit + 1)) as cursor:
+            rows = await cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before_id is not None:
+        rows.reverse()
+    return rows, has_more
+
+# bm25 считает статистику по всем совпадениям, поэтому ранжируем только узкие запросы;
+# широкие («user», «example.com») отдаём в порядке id — это дёшево при любом числе совпадений
+SEARCH_RANK_LIMIT = 1000
+
+SEARCH_COUNT_SQL = "SELECT COUNT(*) FROM (SELECT 1 FROM users_fts WHERE users_fts MATCH :match LIMIT :cap)"
 
-async def deactivate_subscriptions(user_id):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE subscriptions SET active = 0 WHERE user_id = ?", (user_id,))
-        await db.commit()
+SEARCH_SQL = """
+SELECT users.*, -1e18 AS score FROM users WHERE tg_id = :tg_id
+UNION ALL
+SELECT users.*, {score} FROM users_fts JOIN users ON users.id = users_fts.rowid
+WHERE users_fts MATCH :match AND users.tg_id IS NOT :tg_id
+ORDER BY score LIMIT :limit OFFSET :offset
+"""
 
-async def get_all_users():
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT * FROM users") as cursor:
+@timed_query
+async def search_users(query, offset=0, limit=20):
+    # Запрос из цифр ищем как tg_id и как телефон; 8/+7 в начале не важны — сравниваем последние 10 цифр
+    query = query.strip()
+    tg_id = None
+    if re.fullmatch(r"[\d\s()+-]+", query):
+        digits = phone_digits(query)
+        # tg_id — знаковое 64-битное целое; длинные строки цифр ищем только как телефон
+        tg_id = int(digits) if digits and len(digits) <= 18 else None
+        match = f'phone_digits : "{digits[-10:]}"' if len(digits) >= 3 else None
+    else:
+        escaped = query.replace('"', '""')
+        match = f'{{name email}} : "{escaped}"' if len(query) >= 3 else None
+    params = {"tg_id": tg_id, "match": match or '""', "limit": limit + 1, "offset": offset}
+    async with _read() as db:
+        async with db.execute(SEARCH_COUNT_SQL, {"match": params["match"], "cap": SEARCH_RANK_LIMIT + 1}) as cursor:
+            broad = (await cursor.fetchone())[0] > SEARCH_RANK_LIMIT
+        sql = SEARCH_SQL.format(score="users_fts.rowid" if broad else "users_fts.rank")
+        async with db.execute(sql, params) as cursor:
+            rows = await cursor.fetchall()
+    return rows[:limit], len(rows) > limit
+
+# Выражения группировки analytics_daily: неделя начинается с понедельника
+ANALYTICS_PERIODS = {
+    "day": "day",
+    "week": "date(day, 'weekday 0', '-6 days')",
+    "month": "substr(day, 1, 7)",
+}
+
+@timed_query
+async def get_analytics(period, since):
+    # Читает только дневные итоги: (период, выручка, новые, продления, ушли, заявки, одобрено)
+    async with _read() as db:
+        async with db.execute(
+            f"SELECT {ANALYTICS_PERIODS[period]} AS period, SUM(revenue), SUM(new_subs), SUM(renewals), "
+            "SUM(churned), SUM(payment_requests), SUM(payments_approved) "
+            "FROM analytics_daily WHERE day >= ? GROUP BY period ORDER BY period",
+            (since.isoformat(),)
+        ) as cursor:
             return await cursor.fetchall()
 
-async def add_invite_link(user_id, invite_link):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE subscriptions SET invite_link = ? WHERE user_id = ? AND active = 1", (invite_link, user_id))
-        await db.commit()
+EXPORT_COLUMNS = ("id", "tg_id", "name", "phone", "email", "start_date", "end_date", "status")
+
+EXPORT_STATUS_FILTERS = {
+    "all": "1",
+    "active": "s.active = 1 AND s.end_date >= :today",
+    "expired": "s.id IS NOT NULL AND NOT (s.active = 1 AND s.end_date >= :today)",
+    "none": "s.id IS NULL",
+}
+
+async def iter_export_rows(status="all", date_from=None, date_to=None, chunk_size=1000):
+    # Пользователи с последней подпиской; курсор читается пачками, память не зависит от размера таблицы
+    sql = (
+        "SELECT u.id, u.tg_id, u.name, u.phone, u.email, s.start_date, s.end_date, "
+        "CASE WHEN s.id IS NULL THEN 'none' WHEN s.active = 1 AND s.end_date >= :today THEN 'active' "
+        "ELSE 'expired' END "
+        "FROM users u LEFT JOIN subscriptions s "
+        "ON s.id = (SELECT MAX(id) FROM subscriptions WHERE user_id = u.id) "
+        f"WHERE {EXPORT_STATUS_FILTERS[status]}"
+    )
+    params = {"today": date.today().isoformat()}
+    if date_from:
+        sql += " AND s.start_date >= :date_from"
+        params["date_from"] = date_from.isoformat()
+    if date_to:
+        sql += " AND s.start_date <= :date_to"
+        params["date_to"] = date_to.isoformat()
+    sql += " ORDER BY u.id"
+    async with _read() as db:
+        async with db.execute(sql, params) as cursor:
+            while rows := await cursor.fetchmany(chunk_size):
+                yield rows
 
-async def get_invite_link(user_id):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT invite_link FROM subscriptions WHERE user_id = ? AND active = 1", (user_id,)) as cursor:
+@timed_query
+async def get_admin_page_size(tg_id, default=20):
+    async with _read() as db:
+        async with db.execute("SELECT page_size FROM admin_settings WHERE tg_id = ?", (tg_id,)) as cursor:
             row = await cursor.fetchone()
-            return row[0] if row else None 
\ No newline at end of file
+            return row[0] if row else default
+
+@timed_query
+async def set_admin_page_size(tg_id, page_size):
+    async with _write() as db:
+        await db.execute(
+            "INSERT INTO admin_settings (tg_id, page_size) VALUES (?, ?) "
+            "ON CONFLICT (tg_id) DO UPDATE SET page_size = excluded.page_size",
+            (tg_id, page_size)
+        )
+
+async def _issued_invite_link(db, user_id):
+    async with db.execute(
+        "SELECT link, expire_at FROM invite_links WHERE user_id = ? AND expire_at > ? AND revoked = 0 "
+        "ORDER BY expire_at DESC LIMIT 1",
+        (user_id, int(time.time()))
+    ) as cursor:
+        return await cursor.fetchone()
+
+@timed_query
+async def add_invite_link(user_id, invite_link, expire_at):
+    # (ссылка, expire_at, выдана_сейчас); если параллельный запрос уже выдал ссылку — возвращаем её
+    async with _write() as db:
+        issued = await _issued_invite_link(db, user_id)
+        if issued:
+            return issued[0], issued[1], False
+        await db.execute(
+            "INSERT INTO invite_links (link, expire_at, user_id, issued_at) VALUES (?, ?, ?, ?)",
+            (invite_link, expire_at, user_id, int(time.time()))
+        )
+        return invite_link, expire_at, True
+
+@timed_query
+async def add_pool_invite_links(links):
+    async with _write() as db:
+        await db.executemany("INSERT INTO invite_links (link, expire_at) VALUES (?, ?)", links)
+
+@timed_query
+async def count_pool_invite_links(min_expire_at):
+    async with _read() as db:
+        async with db.execute(
+            "SELECT COUNT(*) FROM invite_links WHERE user_id IS NULL AND expire_at > ? AND revoked = 0",
+            (min_expire_at,)
+        ) as cursor:
+            return (await cursor.fetchone())[0]
+
+@timed_query
+async def take_pool_invite_link(user_id, min_expire_at):
+    # (ссылка, expire_at, выдана_сейчас) или None, если пул пуст.
+    # Проверка уже выданной ссылки, выбор и пометка под одной блокировкой писателя:
+    # одну ссылку не выдадут двоим, а двойной /invite не заберёт из пула вторую
+    async with _write() as db:
+        issued = await _issued_invite_link(db, user_id)
+        if issued:
+            return issued[0], issued[1], False
+        async with db.execute(
+            "SELECT id, link, expire_at FROM invite_links WHERE user_id IS NULL AND expire_at > ? AND revoked = 0 "
+            "ORDER BY expire_at DESC LIMIT 1",
+            (min_expire_at,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        await db.execute(
+            "UPDATE invite_links SET user_id = ?, issued_at = ? WHERE id = ?", (user_id, int(time.time()), row[0])
+        )
+        return row[1], row[2], True
+
+@timed_query
+async def take_stale_pool_invite_links(min_expire_at):
+    # Ссылки пула, которые скоро истекут, снимаем с выдачи; давно истёкшие строки удаляем
+    now = int(time.time())
+    async with _write() as db:
+        async with db.execute(
+            "SELECT id, link FROM invite_links WHERE user_id IS NULL AND revoked = 0 AND expire_at BETWEEN ? AND ?",
+            (now, min_expire_at)
+        ) as cursor:
+            stale = await cursor.fetchall()
+        await db.executemany("UPDATE invite_links SET revoked = 1 WHERE id = ?", [(row[0],) for row in stale])
+        await db.execute("DELETE FROM invite_links WHERE expire_at < ?", (now - 7 * 24 * 3600,))
+    return [link for _, link in stale]
+
+@timed_query
+async def take_user_invite_links(user_ids):
+    # Выданные, но ещё действующие ссылки пользователей с погашенной подпиской
+    links = []
+    async with _write() as db:
+        for i in range(0, len(user_ids), 500):
+            chunk = user_ids[i:i + 500]
+            marks = ", ".join("?" * len(chunk))
+            async with db.execute(
+                f"SELECT id, link FROM invite_links WHERE user_id IN ({marks}) AND expire_at > ? AND revoked = 0",
+                (*chunk, int(time.time()))
+            ) as cursor:
+                rows = await cursor.fetchall()
+            await db.executemany("UPDATE invite_links SET revoked = 1 WHERE id = ?", [(row[0],) for row in rows])
+            links += [link for _, link in rows]
+    return links
+
+STATS_SQL = """
+SELECT
+    (SELECT COUNT(*) FROM users),
+    (SELECT COUNT(DISTINCT e.user_id) FROM subscriptions e
+     WHERE e.end_date < :today AND NOT EXISTS (
+         SELECT 1 FROM subscriptions a WHERE a.user_id = e.user_id AND a.active = 1 AND a.end_date >= :today
+     )),
+    s.tariff,
+    s.months,
+    COUNT(s.end_date),
+    SUM(s.end_date <= :soon)
+FROM (SELECT 1) LEFT JOIN (
+    SELECT
+        end_date,
+        tariff,
+        -- Длительность нужна только подпискам без записанного тарифа (созданным до миграции 11)
+        CASE WHEN tariff IS NULL
+             THEN CAST(ROUND((julianday(end_date) - julianday(start_date)) / 30.0) AS INTEGER) END AS months
+    FROM subscriptions WHERE active = 1 AND end_date >= :today
+) AS s ON 1
+GROUP BY s.tariff, s.months
+"""
+
+@timed_query
+async def get_stats(soon_days=3):
+    today = date.today()
+    params = {"today": today.isoformat(), "soon": (today + timedelta(days=soon_days)).isoformat()}
+    stats = {"total": 0, "active": 0, "expiring": 0, "expired": 0, "tariffs": {}}
+    async with _read() as db:
+        async with db.execute(STATS_SQL, params) as cursor:
+            async for total, expired, tariff, months, active, expiring in cursor:
+                stats["total"] = total
+                stats["expired"] = expired
+                if not active:
+                    continue
+                stats["active"] += active
+                stats["expiring"] += expiring
+                # (tariff, None) для записанного тарифа, (None, месяцев) для старых подписок
+                stats["tariffs"][(tariff, months)] = active
+    return stats
+
+
+@timed_query
+async def create_broadcast(admin_id, text):
+    async with _write() as db:
+        cursor = await db.execute("INSERT INTO broadcasts (admin_id, text) VALUES (?, ?)", (admin_id, text))
+        broadcast_id = cursor.lastrowid
+        cursor = await db.execute(
+            "INSERT INTO broadcast_recipients (broadcast_id, tg_id) SELECT ?, tg_id FROM users",
+            (broadcast_id,)
+        )
+        return broadcast_id, cursor.rowcount
+
+@timed_query
+async def set_broadcast_message(broadcast_id, message_id):
+    async with _write() as db:
+        await db.execute("UPDATE broadcasts SET progress_message_id = ? WHERE id = ?", (message_id, broadcast_id))
+
+@timed_query
+async def get_running_broadcasts():
+    async with _read() as db:
+        async with db.execute(
+            "SELECT id, admin_id, text, progress_message_id FROM broadcasts WHERE status = 'running' ORDER BY id"
+        ) as cursor:
+            return await cursor.fetchall()
+
+@timed_query
+async def get_broadcast_recipients(broadcast_id, after_tg_id, limit):
+    async with _read() as db:
+        async with db.execute(
+            "SELECT tg_id FROM broadcast_recipients "
+            "WHERE broadcast_id = ? AND tg_id > ? AND status = 'pending' ORDER BY tg_id LIMIT ?",
+            (broadcast_id, after_tg_id, limit)
+        ) as cursor:
+            return [row[0] async for row in cursor]
+
+@timed_query
+async def get_broadcast_counts(broadcast_id):
+    async with _read() as db:
+        async with db.execute(
+            "SELECT status, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY status",
+            (broadcast_id,)
+        ) as cursor:
+            return {status: count async for status, count in cursor}
+
+@timed_query
+async def update_broadcast_recipients(broadcast_id, results):
+    async with _write() as db:
+        await db.executemany(
+            "UPDATE broadcast_recipients SET status = ? WHERE broadcast_id = ? AND tg_id = ?",
+            [(status, broadcast_id, tg_id) for tg_id, status in results]
+        )
+
+@timed_query
+async def finish_broadcast(broadcast_id):
+    async with _write() as db:
+        await db.execute(
+            "UPDATE broadcasts SET status = 'done', finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (broadcast_id,)
+        )
+
+@timed_query
+async def create_reconcile_run(started_by=None):
+    async with _write() as db:
+        cursor = await db.execute(
+            "INSERT INTO reconcile_runs (started_by, started_at) VALUES (?, ?)", (started_by, int(time.time()))
+        )
+        return cursor.lastrowid
+
+@timed_query
+async def get_unfinished_reconcile_run():
+    # (id, started_by, cursor_user_id, checked, removed, not_joined, errors) или None
+    async with _read() as db:
+        async with db.execute(
+            "SELECT id, started_by, cursor_user_id, checked, removed, not_joined, errors FROM reconcile_runs "
+            "WHERE status = 'running' ORDER BY id DESC LIMIT 1"
+        ) as cursor:
+            return await cursor.fetchone()
+
+@timed_query
+async def get_last_reconcile_started():
+    async with _read() as db:
+        async with db.execute("SELECT MAX(started_at) FROM reconcile_runs") as cursor:
+            return (await cursor.fetchone())[0]
+
+@timed_query
+async def get_reconcile_page(after_user_id, since, limit):
+    # Пользователи с активной или истёкшей не раньше since подпиской: (user_id, tg_id, подписка действует)
+    async with _read() as db:
+        async with db.execute(
+            "SELECT s.user_id, u.tg_id, MAX(s.active = 1 AND s.end_date >= :today) "
+            "FROM subscriptions s JOIN users u ON u.id = s.user_id "
+            "WHERE s.user_id > :after AND s.end_date >= :since "
+            "GROUP BY s.user_id ORDER BY s.user_id LIMIT :limit",
+            {"today": date.today().isoformat(), "after": after_user_id, "since": since.isoformat(), "limit": limit}
+        ) as cursor:
+            return await cursor.fetchall()
+
+@timed_query
+async def save_reconcile_progress(run_id, cursor_user_id, stats, findings):
+    # stats: {"checked", "removed", "not_joined", "errors"} — приращения за страницу; findings: [(tg_id, kind)]
+    async with _write() as db:
+        await db.execute(
+            "UPDATE reconcile_runs SET cursor_user_id = ?, checked = checked + ?, removed = removed + ?, "
+            "not_joined = not_joined + ?, errors = errors + ? WHERE id = ?",
+            (cursor_user_id, stats["checked"], stats["removed"], stats["not_joined"], stats["errors"], run_id)
+        )
+        await db.executemany(
+            "INSERT INTO reconcile_findings (run_id, tg_id, kind) VALUES (?, ?, ?)",
+            [(run_id, tg_id, kind) for tg_id, kind in findings]
+        )
+
+@timed_query
+async def finish_reconcile_run(run_id):
+    # (checked, removed, not_joined, errors)
+    async with _write() as db:
+        await db.execute(
+            "UPDATE reconcile_runs SET status = 'done', finished_at = ? WHERE id = ?", (int(time.time()), run_id)
+        )
+        async with db.execute(
+            "SELECT checked, removed, not_joined, errors FROM reconcile_runs WHERE id = ?", (run_id,)
+        ) as cursor:
+            return await cursor.fetchone()
+
+@timed_query
+async def get_reconcile_findings(run_id, kind, limit=20):
+    async with _read() as db:
+        async with db.execute(
+            "SELECT tg_id FROM reconcile_findings WHERE run_id = ? AND kind = ? LIMIT ?", (run_id, kind, limit)
+        ) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+@timed_query
+async def get_fsm_record(key):
+    async with _read() as db:
+        async with db.execute("SELECT state, data, updated_at FROM fsm_storage WHERE key = ?", (key,)) as cursor:
+            return await cursor.fetchone()
+
+@timed_query
+async def save_fsm_records(upserts, deletes):
+    async with _write() as db:
+        await db.executemany(
+            "INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at",
+            upserts
+        )
+        await db.executemany("DELETE FROM fsm_storage WHERE key = ?", [(key,) for key in deletes])
+
+@timed_query
+async def delete_expired_fsm_records(before):
+    async with _write() as db:
+        cursor = await db.execute("DELETE FROM fsm_storage WHERE updated_at < ?", (before,))
+        return cursor.rowcount
@@ -0,0 +1,40 @@
+import asyncio
+import csv
+import gzip
+import json
+import os
+import tempfile
+from contextlib import aclosing
+from database import EXPORT_COLUMNS, iter_export_rows
+
+FORMATS = ("csv", "jsonl")
+
+
+def _write_csv(stream, rows):
+    csv.writer(stream).writerows(rows)
+
+
+def _write_jsonl(stream, rows):
+    stream.writelines(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n" for row in rows)
+
+
+async def export_users(fmt="csv", status="all", date_from=None, date_to=None):
+    # Пишет выгрузку в сжатый временный файл и возвращает (путь, число строк); файл удаляет вызывающий
+    write = _write_csv if fmt == "csv" else _write_jsonl
+    fd, path = tempfile.mkstemp(prefix="export_", suffix=f".{fmt}.gz")
+    os.close(fd)
+    count = 0
+    try:
+        with gzip.open(path, "wt", encoding="utf-8", newline="") as stream:
+            if fmt == "csv":
+                await asyncio.to_thread(_write_csv, stream, [EXPORT_COLUMNS])
+            # aclosing сразу возвращает соединение в пул читателей, даже если запись упала
+            async with aclosing(iter_export_rows(status, date_from, date_to)) as chunks:
+                async for rows in chunks:
+                    # Сжатие и запись — в отдельном потоке, чтобы не держать event loop
+                    await asyncio.to_thread(write, stream, rows)
+                    count += len(rows)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, count
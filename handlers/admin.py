@@ -1,9 +1,19 @@
+import csv
+import html
+import io
+import os
+import re
 from aiogram import Router, F
 from aiogram.filters import Command
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from config import ADMIN_IDS
-from database import get_all_users, get_user, get_subscription
-from datetime import datetime
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, BufferedInputFile, FSInputFile
+from config import ADMIN_IDS, TARIFFS
+from database import get_user, get_subscription, get_stats, get_users_page, get_admin_page_size, set_admin_page_size, search_users, cache_stats, activate_subscription, decide_payment_request, get_pending_payment_requests, bulk_activate_subscriptions, EXPORT_STATUS_FILTERS, get_analytics, ANALYTICS_PERIODS, MANUAL_TARIFF
+from broadcast import start_broadcast
+from export import export_users, FORMATS
+from reconcile import start_reconcile
+from outbound import outbound_scheduler, notify, send_in_background
+from middlewares import throttling
+from datetime import datetime, date, timedelta
 from aiogram.fsm.context import FSMContext
 
 router = Router()
@@ -19,6 +29,8 @@ async def cmd_admin(message: Message):
              InlineKeyboardButton(text="📋 Пользователи", callback_data="admin_users")],
             [InlineKeyboardButton(text="📢 Рассылка", callback_data="admin_broadcast")],
             [InlineKeyboardButton(text="🔑 Активировать подписку", callback_data="admin_activate_sub")],
+            [InlineKeyboardButton(text="🧾 Заявки на оплату", callback_data="admin_pending")],
+            [InlineKeyboardButton(text="📈 Аналитика", callback_data="admin_analytics")],
         ]
     )
     await message.answer(
@@ -27,40 +39,151 @@ async def cmd_admin(message: Message):
         reply_markup=kb
     )
 
+def _tariff_title(tariff, months):
+    if tariff in TARIFFS:
+        return TARIFFS[tariff]["title"]
+    if tariff == MANUAL_TARIFF:
+        return "выданы вручную"
+    if tariff is not None:
+        return f"тариф {tariff} (снят с продажи)"
+    return f"~{months} мес. (без тарифа)"
+
+def _tariff_order(item):
+    (tariff, months), _ = item
+    keys = list(TARIFFS)
+    return (keys.index(tariff) if tariff in keys else len(keys), tariff or "", months or 0)
+
 @router.callback_query(F.data == "admin_stats")
 async def cb_admin_stats(callback: CallbackQuery):
-    users = await get_all_users()
-    total = len(users)
-    active = 0
-    for u in users:
-        sub = await get_subscription(u[0])
-        if sub:
-            end = datetime.strptime(sub[3], "%d.%m.%Y")
-            if (end - datetime.now()).days > 0:
-                active += 1
+    stats = await get_stats()
+    cache = cache_stats()
+    cache_hits = sum(c["hits"] for c in cache.values())
+    cache_total = cache_hits + sum(c["misses"] for c in cache.values())
+    queue = outbound_scheduler.queue_depth()
+    dropped = throttling.stats
+    tariffs = "\n".join(
+        f"• {_tariff_title(tariff, months)}: <b>{count}</b>"
+        for (tariff, months), count in sorted(stats["tariffs"].items(), key=_tariff_order)
+    ) or "• нет активных подписок"
     await callback.message.answer(
         f"<b>📊 Статистика бота</b>\n\n"
-        f"👥 Всего пользователей: <b>{total}</b>\n"
-        f"✅ Активных подписок: <b>{active}</b>\n"
-        f"❌ Без подписки: <b>{total - active}</b>\n\n"
+        f"👥 Всего пользователей: <b>{stats['total']}</b>\n"
+        f"✅ Активных подписок: <b>{stats['active']}</b>\n"
+        f"⏳ Истекают в ближайшие 3 дня: <b>{stats['expiring']}</b>\n"
+        f"⌛️ Истёкших: <b>{stats['expired']}</b>\n"
+        f"❌ Без подписки: <b>{stats['total'] - stats['active']}</b>\n\n"
+        f"<b>По тарифам:</b>\n{tariffs}\n\n"
+        f"💾 Кэш: {cache_hits}/{cache_total} попаданий\n"
+        f"🛡 Отброшено: {dropped['throttled']} частых, {dropped['duplicates']} повторов\n"
+        f"📤 Очередь Bot API (ответы / админам / массовые): {queue['interactive']} / {queue['admin']} / {queue['bulk']}\n"
         f"🕒 Последнее обновление: {datetime.now().strftime('%d.%m.%Y %H:%M')}"
     )
     await callback.answer()
 
+MAX_PAGE_SIZE = 50
+
+async def _users_page(admin_id, after_id=0, before_id=None):
+    page_size = await get_admin_page_size(admin_id)
+    users, has_more = await get_users_page(after_id, before_id, page_size)
+    if before_id is None:
+        has_prev, has_next = after_id > 0, has_more
+    else:
+        has_prev, has_next = has_more, True
+    rows = [
+        [InlineKeyboardButton(text=f"👤 {u[2]} ({u[1]})", callback_data=f"admin_user_{u[1]}")] for u in users
+    ]
+    nav = []
+    if users and has_prev:
+        nav.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"admin_users_prev_{users[0][0]}"))
+    if users and has_next:
+        nav.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=f"admin_users_next_{users[-1][0]}"))
+    if nav:
+        rows.append(nav)
+    return users, InlineKeyboardMarkup(inline_keyboard=rows)
+
 @router.callback_query(F.data == "admin_users")
 async def cb_admin_users(callback: CallbackQuery):
-    users = await get_all_users()
+    users, kb = await _users_page(callback.from_user.id)
     if not users:
         await callback.message.answer("❗️ Нет зарегистрированных пользователей.")
+        await callback.answer()
         return
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text=f"👤 {u[2]} ({u[1]})", callback_data=f"admin_user_{u[1]}")] for u in users
-        ]
-    )
     await callback.message.answer("<b>📋 Список пользователей:</b>", reply_markup=kb)
     await callback.answer()
 
+@router.callback_query(F.data.startswith("admin_users_"))
+async def cb_admin_users_page(callback: CallbackQuery):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("⛔️ Доступ запрещён.", show_alert=True)
+        return
+    _, _, direction, cursor_id = callback.data.split("_")
+    if direction == "next":
+        users, kb = await _users_page(callback.from_user.id, after_id=int(cursor_id))
+    else:
+        users, kb = await _users_page(callback.from_user.id, before_id=int(cursor_id))
+    if users:
+        await callback.message.edit_reply_markup(reply_markup=kb)
+    await callback.answer()
+
+@router.message(Command("pagesize"))
+async def cmd_pagesize(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔️ Доступ запрещён.")
+        return
+    args = message.text.split()
+    if len(args) != 2 or not args[1].isdigit() or not 1 <= int(args[1]) <= MAX_PAGE_SIZE:
+        page_size = await get_admin_page_size(message.from_user.id)
+        await message.answer(
+            f"Сейчас на странице: <b>{page_size}</b> пользователей.\n"
+            f"Использование: /pagesize N (от 1 до {MAX_PAGE_SIZE})"
+        )
+        return
+    await set_admin_page_size(message.from_user.id, int(args[1]))
+    await message.answer(f"✅ Размер страницы списка пользователей: <b>{args[1]}</b>")
+
+async def _find_page(admin_id, query, offset):
+    page_size = await get_admin_page_size(admin_id)
+    users, has_more = await search_users(query, offset, page_size)
+    rows = [
+        [InlineKeyboardButton(text=f"👤 {u[2]} ({u[1]})", callback_data=f"admin_user_{u[1]}")] for u in users
+    ]
+    nav = []
+    if offset > 0:
+        nav.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"find_page_{max(offset - page_size, 0)}"))
+    if has_more:
+        nav.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=f"find_page_{offset + page_size}"))
+    if nav:
+        rows.append(nav)
+    return users, InlineKeyboardMarkup(inline_keyboard=rows)
+
+@router.message(Command("find"))
+async def cmd_find(message: Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔️ Доступ запрещён.")
+        return
+    query = message.text.partition(' ')[2].strip()
+    if not query:
+        await message.answer("Использование: /find имя, телефон, email или tg_id\nПример: /find 89870812935")
+        return
+    users, kb = await _find_page(message.from_user.id, query, 0)
+    if not users:
+        await message.answer(f"🔎 По запросу «{html.escape(query)}» ничего не найдено.")
+        return
+    # Запрос не помещается в callback_data, поэтому храним его в FSM-данных админа
+    await state.update_data(find_query=query)
+    await message.answer(f"<b>🔎 Результаты по запросу «{html.escape(query)}»:</b>", reply_markup=kb)
+
+@router.callback_query(F.data.startswith("find_page_"))
+async def cb_find_page(callback: CallbackQuery, state: FSMContext):
+    query = (await state.get_data()).get("find_query")
+    if not query:
+        await callback.answer("Поиск устарел, повторите /find", show_alert=True)
+        return
+    users, kb = await _find_page(callback.from_user.id, query, int(callback.data.split("_")[-1]))
+    if users:
+        await callback.message.edit_reply_markup(reply_markup=kb)
+    await callback.answer()
+
 @router.callback_query(F.data.startswith("admin_user_"))
 async def admin_user_info(callback: CallbackQuery):
     tg_id = int(callback.data.split("_")[-1])
@@ -73,8 +196,8 @@ async def admin_user_info(callback: CallbackQuery):
     days_left = 0
     if sub:
         sub_status = "✅ Активна"
-        end = datetime.strptime(sub[3], "%d.%m.%Y")
-        days_left = (end - datetime.now()).days
+        end = date.fromisoformat(sub[3])
+        days_left = (end - date.today()).days
         if days_left < 0:
             days_left = 0
     await callback.message.answer(
@@ -102,15 +225,19 @@ async def cmd_send_broadcast(message: Message):
     if not text:
         await message.answer("Введите текст для рассылки после команды.\nПример: /send Ваш текст")
         return
-    users = await get_all_users()
-    sent = 0
-    for u in users:
-        try:
-            await message.bot.send_message(u[1], text)
-            sent += 1
-        except Exception:
-            pass
-    await message.answer(f"📢 Рассылка завершена. Сообщение отправлено {sent} пользователям.")
+    broadcast_id = await start_broadcast(message.bot, message.from_user.id, text)
+    await message.answer(f"📢 Рассылка #{broadcast_id} запущена в фоне. Прогресс обновляется в сообщении выше.")
+
+@router.message(Command("reconcile"))
+async def cmd_reconcile(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔️ Доступ запрещён.")
+        return
+    run_id = await start_reconcile(message.bot, message.from_user.id)
+    if run_id is None:
+        await message.answer("⏳ Сверка канала уже идёт, отчёт придёт по её завершении.")
+        return
+    await message.answer(f"🔍 Сверка канала #{run_id} запущена. Отчёт придёт сюда, когда она закончится.")
 
 @router.callback_query(F.data == "admin_activate_sub")
 async def cb_admin_activate_sub(callback: CallbackQuery):
@@ -136,14 +263,267 @@ async def cmd_activate_sub(message: Message):
     if not user:
         await message.answer("Пользователь не найден.")
         return
-    from database import deactivate_subscriptions, add_subscription
-    from datetime import datetime, timedelta
-    await deactivate_subscriptions(user[0])
-    start = datetime.now()
-    end = start + timedelta(days=30*months)
-    await add_subscription(user[0], start.strftime("%d.%m.%Y"), end.strftime("%d.%m.%Y"))
+    end = await activate_subscription(user[0], months)
     await message.answer(f"✅ Подписка активирована для пользователя <b>{user[2]}</b> (<code>{tg_id}</code>) на <b>{months}</b> мес.")
+    await notify(message.bot, tg_id, f"🎉 Ваша подписка активирована до {end.strftime('%d.%m.%Y')}! Спасибо за оплату.")
+
+BULK_MAX_FILE_SIZE = 5 * 1024 * 1024
+BULK_MAX_MONTHS = 120
+
+def _parse_bulk_rows(text):
+    # Строки "tg_id,months" (также ";" или пробел); заголовок и пустые строки пропускаются
+    rows, errors, seen = [], [], set()
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        parts = [p for p in re.split(r"[,;\s]+", line.strip()) if p]
+        if not parts:
+            continue
+        if line_no == 1 and not parts[0].lstrip("-").isdigit():
+            continue
+        if len(parts) != 2 or not parts[0].isdigit() or not parts[1].isdigit():
+            errors.append((line_no, line.strip(), "ожидается tg_id,months"))
+            continue
+        tg_id, months = int(parts[0]), int(parts[1])
+        if not 1 <= months <= BULK_MAX_MONTHS:
+            errors.append((line_no, line.strip(), f"months должно быть от 1 до {BULK_MAX_MONTHS}"))
+        elif tg_id in seen:
+            errors.append((line_no, line.strip(), "tg_id повторяется"))
+        else:
+            seen.add(tg_id)
+            rows.append((tg_id, months))
+    return rows, errors
+
+# Регистрируется раньше справки: Command смотрит и в подпись к файлу
+@router.message(Command("bulk_activate"), F.document)
+async def cmd_bulk_activate(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔️ Доступ запрещён.")
+        return
+    if message.document.file_size and message.document.file_size > BULK_MAX_FILE_SIZE:
+        await message.answer("❗️ Файл слишком большой (максимум 5 МБ).")
+        return
+    content = await message.bot.download(message.document)
+    try:
+        text = content.read().decode("utf-8-sig")
+    except UnicodeDecodeError:
+        await message.answer("❗️ Файл должен быть в кодировке UTF-8.")
+        return
+    rows, errors = _parse_bulk_rows(text)
+    activated, missing = await bulk_activate_subscriptions(rows) if rows else ({}, [])
+    months_by_id = dict(rows)
+    send_in_background(message.bot, [
+        (tg_id, f"🎉 Ваша подписка активирована до {end.strftime('%d.%m.%Y')}! Спасибо за оплату.")
+        for tg_id, end in activated.items()
+    ])
+
+    report = io.StringIO()
+    writer = csv.writer(report)
+    writer.writerow(["tg_id", "months", "status", "detail"])
+    for tg_id, end in activated.items():
+        writer.writerow([tg_id, months_by_id[tg_id], "activated", end.isoformat()])
+    for tg_id in missing:
+        writer.writerow([tg_id, months_by_id[tg_id], "not_found", "пользователь не зарегистрирован"])
+    for line_no, line, reason in errors:
+        writer.writerow(["", "", "invalid", f"строка {line_no}: {line} — {reason}"])
+    await message.answer_document(
+        BufferedInputFile(report.getvalue().encode("utf-8-sig"), filename="bulk_activate_report.csv"),
+        caption=(
+            f"<b>📄 Массовая активация</b>\n\n"
+            f"✅ Активировано: <b>{len(activated)}</b>\n"
+            f"👤 Не найдено: <b>{len(missing)}</b>\n"
+            f"⚠️ Ошибок в файле: <b>{len(errors)}</b>"
+        )
+    )
+
+@router.message(Command("bulk_activate"))
+async def cmd_bulk_activate_help(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔️ Доступ запрещён.")
+        return
+    await message.answer(
+        "📄 Отправьте CSV/TXT-файл со строками <code>tg_id,months</code> "
+        "и подписью <code>/bulk_activate</code> к файлу.\n\n"
+        "Пример содержимого:\n<code>123456789,3\n987654321,12</code>"
+    )
+
+ANALYTICS_DEFAULTS = {"day": 14, "week": 8, "month": 6}
+MAX_ANALYTICS_PERIODS = 90
+
+def _analytics_since(period, count):
+    today = date.today()
+    if period == "day":
+        return today - timedelta(days=count - 1)
+    if period == "week":
+        return today - timedelta(days=today.weekday() + 7 * (count - 1))
+    months = today.year * 12 + today.month - 1 - (count - 1)
+    return date(months // 12, months % 12 + 1, 1)
+
+async def _analytics_text(period, count):
+    rows = await get_analytics(period, _analytics_since(period, count))
+    if not rows:
+        return "📈 За выбранный период событий нет."
+    lines = [f"{'Период':<10} {'Выручка':>8} {'Нов':>4} {'Прод':>4} {'Ушли':>4} {'Заяв':>4} {'Конв':>5}"]
+    totals = [0] * 6
+    for period_key, *values in rows:
+        totals = [total + (value or 0) for total, value in zip(totals, values)]
+        revenue, new_subs, renewals, churned, requests, approved = (value or 0 for value in values)
+        conversion = f"{approved * 100 // requests}%" if requests else "—"
+        lines.append(f"{period_key:<10} {revenue:>8} {new_subs:>4} {renewals:>4} {churned:>4} {requests:>4} {conversion:>5}")
+    revenue, new_subs, renewals, churned, requests, approved = totals
+    conversion = f"{approved * 100 // requests}%" if requests else "—"
+    lines.append(f"{'Итого':<10} {revenue:>8} {new_subs:>4} {renewals:>4} {churned:>4} {requests:>4} {conversion:>5}")
+    table = html.escape("\n".join(lines))
+    return (
+        f"<b>📈 Аналитика ({period}, последние {count})</b>\n\n<pre>{table}</pre>\n"
+        "Нов — новые подписчики, Прод — продления, Ушли — не продлили, "
+        "Конв — доля одобренных заявок на оплату."
+    )
+
+@router.message(Command("analytics"))
+async def cmd_analytics(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔️ Доступ запрещён.")
+        return
+    args = message.text.split()[1:]
+    period = args[0] if args else "day"
+    if period not in ANALYTICS_PERIODS or len(args) > 2 or (len(args) == 2 and not args[1].isdigit()):
+        await message.answer("Использование: /analytics [day|week|month] [количество периодов]\nПример: /analytics week 12")
+        return
+    count = min(int(args[1]), MAX_ANALYTICS_PERIODS) if len(args) == 2 else ANALYTICS_DEFAULTS[period]
+    await message.answer(await _analytics_text(period, max(count, 1)))
+
+@router.callback_query(F.data == "admin_analytics")
+async def cb_admin_analytics(callback: CallbackQuery):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("⛔️ Доступ запрещён.", show_alert=True)
+        return
+    await callback.message.answer(await _analytics_text("day", ANALYTICS_DEFAULTS["day"]))
+    await callback.answer()
+
+def _parse_date(value):
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    return None
+
+@router.message(Command("export"))
+async def cmd_export(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔️ Доступ запрещён.")
+        return
+    fmt, status, dates = "csv", "all", []
+    for arg in message.text.split()[1:]:
+        if arg in FORMATS:
+            fmt = arg
+        elif arg in EXPORT_STATUS_FILTERS:
+            status = arg
+        elif (parsed := _parse_date(arg)) and len(dates) < 2:
+            dates.append(parsed)
+        else:
+            await message.answer(
+                "Использование: /export [csv|jsonl] [all|active|expired|none] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД]\n"
+                "Даты ограничивают начало подписки.\nПример: /export jsonl active 2026-01-01 2026-03-31"
+            )
+            return
+    date_from, date_to = (dates + [None, None])[:2]
+    path, count = await export_users(fmt, status, date_from, date_to)
     try:
-        await message.bot.send_message(tg_id, f"🎉 Ваша подписка активирована до {end.strftime('%d.%m.%Y')}! Спасибо за оплату.")
-    except Exception:
-        pass 
\ No newline at end of file
+        await message.answer_document(
+            FSInputFile(path, filename=f"users_{status}_{date.today().isoformat()}.{fmt}.gz"),
+            caption=f"📦 Выгрузка пользователей: <b>{count}</b> строк"
+        )
+    finally:
+        os.remove(path)
+
+async def _pending_page(admin_id, after_id=0, before_id=None):
+    page_size = await get_admin_page_size(admin_id)
+    requests, has_more = await get_pending_payment_requests(after_id, before_id, page_size)
+    if before_id is None:
+        has_prev, has_next = after_id > 0, has_more
+    else:
+        has_prev, has_next = has_more, True
+    # После решения по заявке из списка перерисовываем ту же страницу
+    cursor = requests[0][0] - 1 if requests else 0
+    rows = []
+    for request_id, tg_id, name, months, _ in requests:
+        rows.append([InlineKeyboardButton(text=f"#{request_id} {name} — {months} мес.", callback_data=f"admin_user_{tg_id}")])
+        rows.append([
+            InlineKeyboardButton(text="✅ Одобрить", callback_data=f"pay_ok_{request_id}_{cursor}"),
+            InlineKeyboardButton(text="❌ Отклонить", callback_data=f"pay_no_{request_id}_{cursor}"),
+        ])
+    nav = []
+    if requests and has_prev:
+        nav.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"pending_prev_{requests[0][0]}"))
+    if requests and has_next:
+        nav.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=f"pending_next_{requests[-1][0]}"))
+    if nav:
+        rows.append(nav)
+    return requests, InlineKeyboardMarkup(inline_keyboard=rows)
+
+async def _send_pending(message, admin_id):
+    requests, kb = await _pending_page(admin_id)
+    if not requests:
+        await message.answer("✅ Необработанных заявок на оплату нет.")
+        return
+    await message.answer("<b>🧾 Заявки на оплату:</b>", reply_markup=kb)
+
+@router.message(Command("pending"))
+async def cmd_pending(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔️ Доступ запрещён.")
+        return
+    await _send_pending(message, message.from_user.id)
+
+@router.callback_query(F.data == "admin_pending")
+async def cb_admin_pending(callback: CallbackQuery):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("⛔️ Доступ запрещён.", show_alert=True)
+        return
+    await _send_pending(callback.message, callback.from_user.id)
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("pending_"))
+async def cb_pending_page(callback: CallbackQuery):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("⛔️ Доступ запрещён.", show_alert=True)
+        return
+    _, direction, cursor_id = callback.data.split("_")
+    if direction == "next":
+        requests, kb = await _pending_page(callback.from_user.id, after_id=int(cursor_id))
+    else:
+        requests, kb = await _pending_page(callback.from_user.id, before_id=int(cursor_id))
+    if requests:
+        await callback.message.edit_reply_markup(reply_markup=kb)
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("pay_"))
+async def cb_payment_decision(callback: CallbackQuery):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("⛔️ Доступ запрещён.", show_alert=True)
+        return
+    parts = callback.data.split("_")
+    approve = parts[1] == "ok"
+    result = await decide_payment_request(int(parts[2]), callback.from_user.id, approve)
+    if result is None:
+        await callback.answer("Заявка уже обработана.", show_alert=True)
+    else:
+        tg_id, name, months, end = result
+        if approve:
+            verdict = f"✅ Одобрено: {html.escape(name or '')} — {months} мес., до {end.strftime('%d.%m.%Y')}"
+            await notify(callback.bot, tg_id, f"🎉 Ваша подписка активирована до {end.strftime('%d.%m.%Y')}! Спасибо за оплату.")
+        else:
+            verdict = f"❌ Отклонено: {html.escape(name or '')} — {months} мес."
+            await notify(callback.bot, tg_id, "❌ Заявка на оплату отклонена. Если это ошибка, свяжитесь с администратором.")
+        await callback.answer(verdict)
+    if len(parts) == 4:
+        # Решение из списка /pending — обновляем страницу
+        requests, kb = await _pending_page(callback.from_user.id, after_id=int(parts[3]))
+        if requests:
+            await callback.message.edit_reply_markup(reply_markup=kb)
+        else:
+            await callback.message.edit_text("✅ Необработанных заявок на оплату нет.")
+    elif result is not None:
+        await callback.message.edit_text(f"{callback.message.html_text}\n\n{verdict}")
+    else:
+        await callback.message.edit_reply_markup(reply_markup=None)
@@ -1,12 +1,14 @@
-from aiogram import Router, F, types
+from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from database import get_user, add_user, update_user_email, update_user_phone, get_subscription, add_subscription, deactivate_subscriptions, add_invite_link, get_invite_link
-from keyboards import main_kb, tariff_kb
-from config import ADMIN_IDS, CHANNEL_ID
-from datetime import datetime, timedelta
+from database import get_user, add_user, update_user_email, update_user_phone, get_subscription, phone_digits, create_payment_request
+from invites import get_or_issue_invite_link
+from keyboards import main_kb, tariff_kb, payment_request_kb
+from outbound import notify_admins
+from config import TARIFFS
+from datetime import datetime, date
 import re
 
 router = Router()
@@ -38,8 +40,7 @@ async def cmd_registration(message: Message, state: FSMContext):
 async def reg_phone(message: Message, state: FSMContext):
     phone = message.text.strip()
     # Валидация телефона: только цифры, допускается +7, 7, 8, длина 10-15
-    phone_digits = re.sub(r'\D', '', phone)
-    if not (10 <= len(phone_digits) <= 15):
+    if not (10 <= len(phone_digits(phone)) <= 15):
         await message.answer("❗️ Введите корректный номер телефона (10-15 цифр, например, 89870812935 или +79870812935):")
         return
     await state.update_data(phone=phone)
@@ -82,8 +83,8 @@ async def cmd_info(message: Message):
     days_left = 0
     if sub:
         sub_status = "✅ Активна"
-        end = datetime.strptime(sub[3], "%d.%m.%Y")
-        days_left = (end - datetime.now()).days
+        end = date.fromisoformat(sub[3])
+        days_left = (end - date.today()).days
         if days_left < 0:
             days_left = 0
     await message.answer(
@@ -113,18 +114,21 @@ async def cmd_buy(message: Message):
 
 @router.callback_query(F.data.startswith("tariff_"))
 async def process_tariff(callback: CallbackQuery):
-    tariff = callback.data.split("_")[1]
-    days = {"1": 30, "3": 90, "12": 365}[tariff]
-    price = {"1": 200, "3": 500, "12": 1500}[tariff]
+    key = callback.data.split("_")[1]
+    tariff = TARIFFS.get(key)
+    if tariff is None:
+        # Кнопка от снятого с продажи тарифа
+        await callback.answer("Этот тариф больше недоступен, выберите другой: /buy", show_alert=True)
+        return
     user = await get_user(callback.from_user.id)
     pay_kb = InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="✅ Оплатил", callback_data=f"paid_{tariff}")]
+            [InlineKeyboardButton(text="✅ Оплатил", callback_data=f"paid_{key}")]
         ]
     )
     await callback.message.answer(
-        f"<b>💳 Оплата подписки на {days // 30} месяц(ев)</b>\n\n"
-        f"💰 <b>Сумма к оплате:</b> {price}₽\n\n"
+        f"<b>💳 Оплата подписки на {tariff['months']} месяц(ев)</b>\n\n"
+        f"💰 <b>Сумма к оплате:</b> {tariff['price']}₽\n\n"
         f"<b>Реквизиты для оплаты:</b>\n"
         f"📱 Номер телефона: 89870812935\n"
         f"💳 Карта: 2202208399336685\n"
@@ -142,21 +146,31 @@ async def process_tariff(callback: CallbackQuery):
 @router.callback_query(F.data.startswith("paid_"))
 async def paid_callback(callback: CallbackQuery):
     user = await get_user(callback.from_user.id)
-    tariff = callback.data.split("_")[1]
-    months = {"1": 1, "3": 3, "12": 12}[tariff]
-    for admin_id in ADMIN_IDS:
-        try:
-            await callback.bot.send_message(
-                admin_id,
-                f"💸 <b>Поступила заявка на оплату!</b>\n\n"
-                f"👤 Пользователь: <b>{user[2]}</b>\n"
-                f"🆔 ID: <code>{user[1]}</code>\n"
-                f"Тариф: {months} мес.\n\n"
-                f"Проверьте чек и активируйте подписку командой:\n"
-                f"/activate_sub {user[1]} {months}"
-            )
-        except Exception:
-            pass
+    if not user:
+        await callback.message.answer("Вы не зарегистрированы. Используйте /registration.")
+        await callback.answer()
+        return
+    key = callback.data.split("_")[1]
+    tariff = TARIFFS.get(key)
+    if tariff is None:
+        await callback.answer("Этот тариф больше недоступен, выберите другой: /buy", show_alert=True)
+        return
+    months = tariff["months"]
+    # Цена фиксируется в заявке: если тариф подорожает до проверки, пользователь платит по старой
+    request_id, created = await create_payment_request(user[0], key, months, tariff["price"])
+    if not created:
+        await callback.answer("Заявка по этому тарифу уже отправлена, ожидайте проверки.", show_alert=True)
+        return
+    await notify_admins(
+        callback.bot,
+        f"💸 <b>Поступила заявка на оплату #{request_id}!</b>\n\n"
+        f"👤 Пользователь: <b>{user[2]}</b>\n"
+        f"🆔 ID: <code>{user[1]}</code>\n"
+        f"Тариф: {months} мес.\n"
+        f"Сумма: {tariff['price']}₽\n\n"
+        f"Проверьте чек и подтвердите оплату:",
+        reply_markup=payment_request_kb(request_id)
+    )
     await callback.message.answer("Спасибо! Ваша заявка на оплату отправлена администратору. Подписка будет активирована после проверки.")
     await callback.answer()
 
@@ -170,15 +184,16 @@ async def cmd_subscription(message: Message):
     if not sub:
         await message.answer("У вас нет активной подписки. Используйте /buy для покупки.")
         return
-    end = datetime.strptime(sub[3], "%d.%m.%Y")
-    days_left = (end - datetime.now()).days
+    end = date.fromisoformat(sub[3])
+    start = date.fromisoformat(sub[2])
+    days_left = (end - date.today()).days
     await message.answer(
         f"<b>Информация о подписке</b>\n"
         f"✅ Подписка активна\n"
         f"• Дней осталось: {days_left}\n"
-        f"• Дата окончания: {sub[3]}\n"
+        f"• Дата окончания: {end.strftime('%d.%m.%Y')}\n"
         f"• Автопродление: Отключено\n\n"
-        f"• История подписок:\n• {sub[2]} - {sub[3]}"
+        f"• История подписок:\n• {start.strftime('%d.%m.%Y')} - {end.strftime('%d.%m.%Y')}"
     )
 
 @router.message(Command("invite"))
@@ -191,24 +206,17 @@ async def cmd_invite(message: Message, bot):
     if not sub:
         await message.answer("У вас нет активной подписки. Используйте /buy для покупки.")
         return
-    # Проверяем, была ли уже выдана ссылка
-    invite_link = await get_invite_link(user[0])
-    if invite_link:
+    invite_link, expire_at, new = await get_or_issue_invite_link(bot, user[0])
+    expires = datetime.fromtimestamp(expire_at).strftime('%d.%m.%Y %H:%M')
+    if not new:
         await message.answer(
             f"🔗 Ваша одноразовая инвайт-ссылка уже была выдана ранее:\n\n{invite_link}\n\n"
-            f"⚠️ Ссылка действительна 24 часа и может быть использована только один раз."
+            f"⚠️ Ссылка действительна до {expires} и может быть использована только один раз."
         )
         return
-    # Генерация одноразовой ссылки
-    invite = await bot.create_chat_invite_link(
-        chat_id=CHANNEL_ID,
-        expire_date=int((datetime.now() + timedelta(days=1)).timestamp()),
-        member_limit=1
-    )
-    await add_invite_link(user[0], invite.invite_link)
     await message.answer(
-        f"🎁 Ваша одноразовая инвайт-ссылка в закрытый канал:\n\n{invite.invite_link}\n\n"
-        f"⚠️ Ссылка действительна 24 часа и может быть использована только один раз."
+        f"🎁 Ваша одноразовая инвайт-ссылка в закрытый канал:\n\n{invite_link}\n\n"
+        f"⚠️ Ссылка действительна до {expires} и может быть использована только один раз."
     )
 
 @router.message(lambda m: m.text == "👤 Профиль")
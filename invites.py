@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+from aiogram.exceptions import TelegramAPIError
+from config import CHANNEL_ID
+from database import (
+    add_invite_link, add_pool_invite_links, count_pool_invite_links,
+    take_pool_invite_link, take_stale_pool_invite_links, take_user_invite_links,
+)
+from outbound import BULK, set_priority
+
+POOL_SIZE = 20
+LINK_TTL = 24 * 3600
+# Ссылку, которой осталось жить меньше, не выдаём и заменяем новой
+MIN_REMAINING = 2 * 3600
+REFILL_INTERVAL = 300
+
+logger = logging.getLogger(__name__)
+_refill_needed = asyncio.Event()
+
+
+async def _create_link(bot):
+    expire_at = int(time.time()) + LINK_TTL
+    invite = await bot.create_chat_invite_link(chat_id=CHANNEL_ID, expire_date=expire_at, member_limit=1)
+    return invite.invite_link, expire_at
+
+
+async def _revoke_links(bot, links):
+    for link in links:
+        try:
+            await bot.revoke_chat_invite_link(CHANNEL_ID, link)
+        except TelegramAPIError as e:
+            logger.warning("Failed to revoke invite link %s: %s", link, e)
+
+
+async def remove_from_channel(bot, tg_id):
+    # ban + unban выкидывает из канала, но не мешает вернуться после продления; False при ошибке API
+    try:
+        await bot.ban_chat_member(CHANNEL_ID, tg_id)
+        await bot.unban_chat_member(CHANNEL_ID, tg_id, only_if_banned=True)
+    except TelegramAPIError as e:
+        logger.warning("Failed to remove %s from channel: %s", tg_id, e)
+        return False
+    return True
+
+
+async def get_or_issue_invite_link(bot, user_id):
+    # (ссылка, expire_at, выдана_сейчас)
+    taken = await take_pool_invite_link(user_id, int(time.time()) + MIN_REMAINING)
+    if taken is None:
+        # Пул пуст (например, сразу после старта) — создаём ссылку на месте
+        link, expire_at = await _create_link(bot)
+        taken = await add_invite_link(user_id, link, expire_at)
+        if taken[0] != link:
+            # Параллельный /invite успел выдать другую ссылку — созданная не нужна
+            await _revoke_links(bot, [link])
+    if taken[2]:
+        _refill_needed.set()
+    return taken
+
+
+async def revoke_user_invite_links(bot, user_ids):
+    links = await take_user_invite_links(list(user_ids))
+    await _revoke_links(bot, links)
+    return len(links)
+
+
+async def refill_pool(bot):
+    threshold = int(time.time()) + MIN_REMAINING
+    await _revoke_links(bot, await take_stale_pool_invite_links(threshold))
+    missing = POOL_SIZE - await count_pool_invite_links(threshold)
+    links = []
+    try:
+        for _ in range(missing):
+            links.append(await _create_link(bot))
+    finally:
+        # Сохраняем уже созданные ссылки, даже если на середине получили ошибку
+        if links:
+            await add_pool_invite_links(links)
+
+
+async def run_invite_pool(bot):
+    set_priority(BULK)
+    while True:
+        _refill_needed.clear()
+        try:
+            await refill_pool(bot)
+        except Exception:
+            logger.exception("Invite link pool refill failed")
+        try:
+            await asyncio.wait_for(_refill_needed.wait(), REFILL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
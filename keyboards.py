@@ -1,4 +1,5 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from config import TARIFFS
 
 main_kb = ReplyKeyboardMarkup(
     keyboard=[
@@ -16,8 +17,16 @@ main_kb = ReplyKeyboardMarkup(
 
 tariff_kb = InlineKeyboardMarkup(
     inline_keyboard=[
-        [InlineKeyboardButton(text="1 месяц - 200₽", callback_data="tariff_1")],
-        [InlineKeyboardButton(text="3 месяца - 500₽", callback_data="tariff_3")],
-        [InlineKeyboardButton(text="12 месяцев - 1500₽", callback_data="tariff_12")],
-    ]   
-) 
\ No newline at end of file
+        [InlineKeyboardButton(text=f"{tariff['title']} - {tariff['price']}₽", callback_data=f"tariff_{key}")]
+        for key, tariff in TARIFFS.items()
+    ]
+)
+
+
+def payment_request_kb(request_id):
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Одобрить", callback_data=f"pay_ok_{request_id}"),
+             InlineKeyboardButton(text="❌ Отклонить", callback_data=f"pay_no_{request_id}")]
+        ]
+    )
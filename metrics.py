@@ -0,0 +1,203 @@
+import logging
+import time
+from bisect import bisect_left
+from functools import wraps
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiohttp import web
+from config import METRICS_HOST, METRICS_PORT, SLOW_LOG_MS
+
+# Границы корзин гистограмм в секундах
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+logger = logging.getLogger(__name__)
+_slow_threshold = SLOW_LOG_MS / 1000 if SLOW_LOG_MS > 0 else None
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+# Метрики хранятся в обычных словарях: всё работает в одном event loop, блокировки не нужны
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in self._values.items():
+            yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # label_values -> [счётчики по корзинам (последняя — +Inf), сумма, количество]
+        self._values = {}
+
+    def observe(self, seconds, *label_values):
+        entry = self._values.get(label_values)
+        if entry is None:
+            entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, seconds)] += 1
+        entry[1] += seconds
+        entry[2] += 1
+
+    def totals(self):
+        # label_values -> (количество, сумма секунд)
+        return {label_values: (count, total) for label_values, (_, total, count) in self._values.items()}
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        names = self.labels + ("le",)
+        for label_values, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_labels(names, label_values + (bound,))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {total}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {count}"
+
+
+# Значение снимается в момент запроса /metrics: fn возвращает {значение метки: число}
+class Gauge:
+    def __init__(self, name, help_text, label, fn):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.fn = fn
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for label_value, value in self.fn().items():
+            yield f"{self.name}{_labels((self.label,), (label_value,))} {value}"
+
+
+_registry = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def gauge(name, help_text, label, fn):
+    return register(Gauge(name, help_text, label, fn))
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+handler_latency = register(Histogram("bot_handler_seconds", "Handler latency", ("event", "handler")))
+handler_errors = register(Counter("bot_handler_errors_total", "Handler exceptions", ("event", "handler")))
+db_latency = register(Histogram("bot_db_seconds", "database.py call latency", ("query",)))
+db_errors = register(Counter("bot_db_errors_total", "database.py call exceptions", ("query",)))
+db_lock_wait = register(Histogram("bot_db_write_lock_wait_seconds", "Time spent waiting for the writer connection"))
+api_latency = register(Histogram("bot_api_seconds", "Bot API request latency, per attempt", ("method",)))
+api_errors = register(Counter("bot_api_errors_total", "Bot API errors", ("method", "error")))
+
+
+def _check_slow(kind, name, elapsed):
+    if _slow_threshold is not None and elapsed >= _slow_threshold:
+        logger.warning("Slow %s %s: %.1f ms", kind, name, elapsed * 1000)
+
+
+def timed_query(fn):
+    # Для функций database.py: время вызова целиком, включая ожидание соединения
+    name = fn.__name__
+
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            db_errors.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            db_latency.observe(elapsed, name)
+            _check_slow("query", name, elapsed)
+
+    return wrapper
+
+
+# Внутренний middleware: к этому моменту хендлер уже выбран, его имя и есть метка
+class HandlerMetricsMiddleware(BaseMiddleware):
+    def __init__(self, event_name):
+        self.event_name = event_name
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(self.event_name, name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            handler_latency.observe(elapsed, self.event_name, name)
+            _check_slow("handler", name, elapsed)
+
+
+# Регистрируется после outbound.outbound_scheduler, поэтому меряет сам HTTP-запрос без очереди, каждую попытку отдельно
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        api_method = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramAPIError as e:
+            api_errors.inc(api_method, type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            api_latency.observe(elapsed, api_method)
+            # getUpdates при long polling висит по полминуты — это не медленный запрос
+            if api_method != "getUpdates":
+                _check_slow("api call", api_method, elapsed)
+
+
+api_metrics = ApiMetricsMiddleware()
+
+
+async def handle_metrics(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    # Отдельный локальный сервер, чтобы /metrics не торчал наружу вместе с вебхуком
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics server listening on %s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,66 @@
+import time
+from collections import OrderedDict
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+from config import ADMIN_IDS
+from ratelimit import BucketMap
+
+USER_RATE = 1
+USER_BURST = 5
+DEDUP_WINDOW = 2
+IDLE_TTL = 600
+MAX_USERS = 100000
+
+
+def _expire(entries, deadline):
+    # Записи лежат в порядке добавления, устаревшие всегда в начале
+    while entries:
+        key, (_, ts) = next(iter(entries.items()))
+        if ts > deadline:
+            break
+        del entries[key]
+
+
+# Внешний middleware для сообщений и callback-запросов: токен-бакет на пользователя
+# и отбрасывание повторных нажатий одной кнопки. Повторные заявки на оплату отсекает
+# уникальный индекс payment_requests, а не память процесса
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, rate=USER_RATE, burst=USER_BURST, dedup_window=DEDUP_WINDOW,
+                 idle_ttl=IDLE_TTL, max_users=MAX_USERS):
+        self.dedup_window = dedup_window
+        self.idle_ttl = idle_ttl
+        self.buckets = BucketMap(rate, burst, max_size=max_users)
+        # user_id -> (callback_data, ts)
+        self._callbacks = OrderedDict()
+        self.stats = {"passed": 0, "throttled": 0, "duplicates": 0}
+
+    def _cleanup(self, now):
+        self.buckets.evict_idle(self.idle_ttl)
+        _expire(self._callbacks, now - self.dedup_window)
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or user.id in ADMIN_IDS:
+            return await handler(event, data)
+        now = time.monotonic()
+        self._cleanup(now)
+
+        if isinstance(event, CallbackQuery) and event.data:
+            last = self._callbacks.pop(user.id, None)
+            self._callbacks[user.id] = (event.data, now)
+            if last is not None and last[0] == event.data:
+                self.stats["duplicates"] += 1
+                await event.answer()
+                return None
+
+        if not self.buckets.get(user.id).try_acquire():
+            self.stats["throttled"] += 1
+            if isinstance(event, CallbackQuery):
+                await event.answer("Слишком часто, попробуйте через пару секунд.")
+            return None
+
+        self.stats["passed"] += 1
+        return await handler(event, data)
+
+
+throttling = ThrottlingMiddleware()
@@ -0,0 +1,165 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from config import ADMIN_IDS
+from ratelimit import GLOBAL_RATE, CHAT_RATE, CHAT_BURST, TokenBucket, BucketMap
+
+# Классы приоритета: меньше — раньше
+INTERACTIVE = 0
+ADMIN = 1
+BULK = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", ADMIN: "admin", BULK: "bulk"}
+
+# Массовым отправкам оставляем запас, чтобы ответы пользователям не ждали даже при пустой очереди
+BULK_RATE = 25
+MAX_ATTEMPTS = 5
+MAX_BACKOFF = 30
+# Методы, которые создают сообщения в чате и подпадают под лимит ~1 в секунду на чат
+CHAT_LIMITED_PREFIXES = ("send", "copy", "forward")
+UNSCHEDULED_METHODS = {"getUpdates"}
+
+logger = logging.getLogger(__name__)
+_priority = ContextVar("outbound_priority", default=INTERACTIVE)
+
+
+def set_priority(level):
+    # Для фоновых задач: действует до конца текущей задачи
+    _priority.set(level)
+
+
+@contextmanager
+def priority(level):
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+# Единая очередь исходящих запросов к Bot API: глобальный и поканальный
+# токен-бакеты, приоритеты и повторы при RetryAfter/сетевых ошибках
+class OutboundScheduler(BaseRequestMiddleware):
+    def __init__(self, rate=GLOBAL_RATE, chat_rate=CHAT_RATE, bulk_rate=BULK_RATE, chat_burst=CHAT_BURST):
+        self.bucket = TokenBucket(rate)
+        self.bulk_bucket = TokenBucket(bulk_rate)
+        # Интерактивным ответам и уведомлениям — запас на несколько сообщений подряд,
+        # массовым отправкам — строго одно сообщение в чат за 1/chat_rate секунд
+        self.chats = BucketMap(chat_rate, chat_burst)
+        self.bulk_chats = BucketMap(chat_rate)
+        self._heap = []
+        self._seq = itertools.count()
+        self._depth = dict.fromkeys(PRIORITY_NAMES, 0)
+        self._pump_task = None
+
+    def _chat_bucket(self, level, chat_id):
+        return (self.bulk_chats if level == BULK else self.chats).get(chat_id)
+
+    def queue_depth(self):
+        return {PRIORITY_NAMES[level]: depth for level, depth in self._depth.items()}
+
+    async def _acquire(self, level, chat_id):
+        self._depth[level] += 1
+        try:
+            if chat_id is not None:
+                await self._chat_bucket(level, chat_id).acquire()
+            if level == BULK:
+                await self.bulk_bucket.acquire()
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._heap, (level, next(self._seq), future))
+            if self._pump_task is None:
+                self._pump_task = asyncio.create_task(self._pump())
+            await future
+        finally:
+            self._depth[level] -= 1
+
+    async def _pump(self):
+        # Каждый токен глобального бакета достаётся самому приоритетному из ожидающих
+        try:
+            while self._heap:
+                await self.bucket.acquire()
+                while self._heap:
+                    _, _, future = heapq.heappop(self._heap)
+                    if not future.done():
+                        future.set_result(None)
+                        break
+        finally:
+            self._pump_task = None
+
+    async def __call__(self, make_request, bot, method):
+        api_method = method.__api_method__
+        if api_method in UNSCHEDULED_METHODS:
+            return await make_request(bot, method)
+        level = _priority.get()
+        chat_id = getattr(method, "chat_id", None) if api_method.startswith(CHAT_LIMITED_PREFIXES) else None
+        attempt = 0
+        while True:
+            await self._acquire(level, chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt >= MAX_ATTEMPTS:
+                    raise
+                # Флуд-контроль одного чата не должен тормозить остальных; массовые отправки тормозим целиком
+                if chat_id is not None:
+                    self._chat_bucket(level, chat_id).pause(e.retry_after)
+                if level == BULK:
+                    self.bulk_bucket.pause(e.retry_after)
+                elif chat_id is None:
+                    self.bucket.pause(e.retry_after)
+                logger.warning("%s: retry after %s s (attempt %d)", api_method, e.retry_after, attempt)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempt += 1
+                if attempt >= MAX_ATTEMPTS:
+                    raise
+                logger.warning("%s: %s, retrying (attempt %d)", api_method, e, attempt)
+                await asyncio.sleep(min(2 ** attempt, MAX_BACKOFF))
+
+
+outbound_scheduler = OutboundScheduler()
+
+
+async def notify(bot, chat_id, text, **kwargs):
+    with priority(ADMIN):
+        try:
+            await bot.send_message(chat_id, text, **kwargs)
+            return True
+        except TelegramAPIError as e:
+            logger.warning("Failed to notify %s: %s", chat_id, e)
+            return False
+
+
+async def notify_admins(bot, text, **kwargs):
+    results = await asyncio.gather(*(notify(bot, admin_id, text, **kwargs) for admin_id in ADMIN_IDS))
+    return sum(results)
+
+
+BACKGROUND_CONCURRENCY = 8
+_background = set()
+
+
+async def _send_many(bot, messages):
+    set_priority(BULK)
+    semaphore = asyncio.Semaphore(BACKGROUND_CONCURRENCY)
+
+    async def send(chat_id, text):
+        async with semaphore:
+            try:
+                await bot.send_message(chat_id, text)
+            except TelegramAPIError as e:
+                logger.warning("Failed to send to %s: %s", chat_id, e)
+
+    await asyncio.gather(*(send(chat_id, text) for chat_id, text in messages))
+
+
+def send_in_background(bot, messages):
+    # messages: [(chat_id, text)]; уходят с приоритетом BULK, не задерживая вызывающий хендлер
+    task = asyncio.create_task(_send_many(bot, messages))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
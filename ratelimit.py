@@ -0,0 +1,85 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+# Лимиты Bot API: ~30 сообщений в секунду на бота и ~1 в секунду в один чат
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+# Ответ пользователю часто состоит из пары сообщений подряд; короткий всплеск в один чат Telegram допускает
+CHAT_BURST = 3
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def updated(self):
+        return self._updated
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        # RetryAfter от Telegram: никто не получает токен, пока не истечёт пауза
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+# Бакеты по ключу (чат, пользователь) с вытеснением давно не использованных по LRU
+class BucketMap:
+    def __init__(self, rate, capacity=None, max_size=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_size = max_size
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def get(self, key):
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.capacity)
+            if len(self._buckets) >= self.max_size:
+                self._buckets.popitem(last=False)
+        self._buckets[key] = bucket
+        return bucket
+
+    def evict_idle(self, idle_seconds):
+        # Порядок OrderedDict совпадает с порядком обращений, поэтому хватает проверки с начала
+        deadline = time.monotonic() - idle_seconds
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if bucket.updated > deadline:
+                break
+            del self._buckets[key]
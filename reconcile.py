@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+from datetime import date, timedelta
+from aiogram.exceptions import TelegramAPIError
+from config import CHANNEL_ID, RECONCILE_INTERVAL_HOURS
+from database import (
+    create_reconcile_run, get_unfinished_reconcile_run, get_last_reconcile_started, get_reconcile_page,
+    save_reconcile_progress, finish_reconcile_run, get_reconcile_findings,
+)
+from invites import remove_from_channel
+from outbound import BULK, set_priority, notify, notify_admins
+
+PAGE_SIZE = 200
+CONCURRENCY = 5
+# Истёкшие подписки проверяем ещё столько дней: такие пользователи могли остаться в канале
+RECENT_DAYS = 30
+REPORT_LIMIT = 20
+# Статусы, при которых пользователь может быть в канале; у restricted дополнительно смотрим is_member
+IN_CHANNEL = {"member", "restricted"}
+SKIPPED = {"creator", "administrator"}
+
+logger = logging.getLogger(__name__)
+_current = None
+
+
+async def _check(bot, tg_id, valid, semaphore):
+    # Возвращает kind находки ("removed", "not_joined", "error") или None
+    async with semaphore:
+        try:
+            member = await bot.get_chat_member(CHANNEL_ID, tg_id)
+        except TelegramAPIError as e:
+            logger.warning("Reconcile: failed to check %s: %s", tg_id, e)
+            return "error"
+        if member.status in SKIPPED:
+            return None
+        joined = member.status in IN_CHANNEL and getattr(member, "is_member", True)
+        if valid:
+            return None if joined else "not_joined"
+        if not joined:
+            return None
+        return "removed" if await remove_from_channel(bot, tg_id) else "error"
+
+
+async def _report(bot, run_id, started_by):
+    checked, removed, not_joined, errors = await finish_reconcile_run(run_id)
+    text = (
+        f"<b>🔍 Сверка канала #{run_id} завершена</b>\n\n"
+        f"👥 Проверено: <b>{checked}</b>\n"
+        f"🚪 Удалено без подписки: <b>{removed}</b>\n"
+        f"🙈 С подпиской, но не в канале: <b>{not_joined}</b>\n"
+        f"⚠️ Ошибки проверки: <b>{errors}</b>"
+    )
+    for kind, title, count in (("removed", "Удалены", removed), ("not_joined", "Не вступили", not_joined)):
+        if count:
+            ids = ", ".join(f"<code>{tg_id}</code>" for tg_id in await get_reconcile_findings(run_id, kind, REPORT_LIMIT))
+            more = f" и ещё {count - REPORT_LIMIT}" if count > REPORT_LIMIT else ""
+            text += f"\n\n<b>{title}:</b> {ids}{more}"
+    if started_by:
+        await notify(bot, started_by, text)
+    else:
+        await notify_admins(bot, text)
+
+
+async def _run(bot, run_id, started_by, after):
+    set_priority(BULK)
+    since = date.today() - timedelta(days=RECENT_DAYS)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    while page := await get_reconcile_page(after, since, PAGE_SIZE):
+        results = await asyncio.gather(*(_check(bot, tg_id, valid, semaphore) for _, tg_id, valid in page))
+        stats = {"checked": len(page), "removed": 0, "not_joined": 0, "errors": 0}
+        findings = []
+        for (_, tg_id, _), kind in zip(page, results):
+            if kind == "error":
+                stats["errors"] += 1
+            elif kind:
+                stats[kind] += 1
+                findings.append((tg_id, kind))
+        after = page[-1][0]
+        # Прогресс пишется постранично: после рестарта продолжим со следующей страницы
+        await save_reconcile_progress(run_id, after, stats, findings)
+    await _report(bot, run_id, started_by)
+
+
+def _done(task):
+    if not task.cancelled() and task.exception():
+        logger.error("Channel reconcile failed", exc_info=task.exception())
+
+
+def _spawn(bot, run_id, started_by, after=0):
+    global _current
+    _current = asyncio.create_task(_run(bot, run_id, started_by, after))
+    _current.add_done_callback(_done)
+    return _current
+
+
+def current_run():
+    return _current is not None and not _current.done()
+
+
+async def start_reconcile(bot, started_by=None):
+    # None, если сверка уже идёт; иначе номер новой
+    if current_run():
+        return None
+    run_id = await create_reconcile_run(started_by)
+    _spawn(bot, run_id, started_by)
+    return run_id
+
+
+async def stop_reconcile():
+    if current_run():
+        _current.cancel()
+        await asyncio.gather(_current, return_exceptions=True)
+
+
+async def run_reconcile_scheduler(bot):
+    interval = RECONCILE_INTERVAL_HOURS * 3600
+    unfinished = await get_unfinished_reconcile_run()
+    if unfinished:
+        run_id, started_by, after = unfinished[:3]
+        logger.info("Resuming channel reconcile #%s after user %s", run_id, after)
+        await asyncio.wait({_spawn(bot, run_id, started_by, after)})
+    while True:
+        last = await get_last_reconcile_started() or 0
+        delay = last + interval - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+            continue
+        run_id = await start_reconcile(bot)
+        if run_id is None:
+            # Идёт сверка, запущенная админом; её время старта сдвинет следующую
+            await asyncio.sleep(60)
+            continue
+        await asyncio.wait({_current})
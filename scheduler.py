@@ -0,0 +1,75 @@
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+from config import REMINDER_DAYS
+from database import expire_subscriptions, get_subscriptions_to_remind, mark_reminded
+from invites import remove_from_channel, revoke_user_invite_links
+from outbound import BULK, set_priority
+
+CONCURRENCY = 5
+BATCH_SIZE = 200
+
+logger = logging.getLogger(__name__)
+
+
+async def _revoke(bot, tg_id, semaphore):
+    async with semaphore:
+        await remove_from_channel(bot, tg_id)
+        try:
+            await bot.send_message(tg_id, "⌛️ Ваша подписка закончилась. Продлить её можно командой /buy.")
+        except TelegramAPIError:
+            pass
+
+
+async def _remind(bot, tg_id, end_date, semaphore):
+    async with semaphore:
+        days_left = (date.fromisoformat(end_date) - date.today()).days
+        when = f"через {days_left} дн." if days_left > 0 else "сегодня"
+        try:
+            await bot.send_message(
+                tg_id,
+                f"⏳ Ваша подписка закончится {when} "
+                f"({date.fromisoformat(end_date).strftime('%d.%m.%Y')}).\n"
+                f"Продлить её можно командой /buy."
+            )
+        except TelegramForbiddenError:
+            pass
+        except TelegramAPIError as e:
+            logger.warning("Failed to send expiry reminder to %s: %s", tg_id, e)
+
+
+async def check_subscriptions(bot):
+    set_priority(BULK)
+    today = date.today()
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    expired = await expire_subscriptions(today)
+    # Невыданные в канал ссылки истёкших подписок больше не должны работать
+    await revoke_user_invite_links(bot, [user_id for user_id, _ in expired])
+    for i in range(0, len(expired), BATCH_SIZE):
+        batch = expired[i:i + BATCH_SIZE]
+        await asyncio.gather(*(_revoke(bot, tg_id, semaphore) for _, tg_id in batch))
+    due = await get_subscriptions_to_remind(today + timedelta(days=REMINDER_DAYS))
+    for i in range(0, len(due), BATCH_SIZE):
+        batch = due[i:i + BATCH_SIZE]
+        await asyncio.gather(*(_remind(bot, tg_id, end_date, semaphore) for _, tg_id, end_date in batch))
+        # Отмечаем по пачкам, чтобы после перезапуска не напоминать повторно
+        await mark_reminded([sub_id for sub_id, _, _ in batch])
+    if expired or due:
+        logger.info("Expired %d subscriptions, sent %d reminders", len(expired), len(due))
+
+
+def _seconds_until_tomorrow():
+    now = datetime.now()
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return (tomorrow - now).total_seconds() + 1
+
+
+async def run_expiry_scheduler(bot):
+    # Даты окончания хранятся с точностью до дня, поэтому достаточно проверки при старте и после полуночи
+    while True:
+        try:
+            await check_subscriptions(bot)
+        except Exception:
+            logger.exception("Subscription expiry check failed")
+        await asyncio.sleep(_seconds_until_tomorrow())
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+from database import get_fsm_record, save_fsm_records, delete_expired_fsm_records
+
+FLUSH_DELAY = 0.5
+STATE_TTL = 24 * 3600
+CLEANUP_INTERVAL = 3600
+CACHE_SIZE = 10000
+
+logger = logging.getLogger(__name__)
+
+
+# FSM в таблице fsm_storage: переживает перезапуск через update_server.
+# Изменения копятся в памяти и пишутся одной транзакцией через FLUSH_DELAY,
+# поэтому set_state + update_data в одном хендлере дают одну запись на диск.
+class SQLiteStorage(BaseStorage):
+    def __init__(self, flush_delay=FLUSH_DELAY, ttl=STATE_TTL, cache_size=CACHE_SIZE):
+        self.flush_delay = flush_delay
+        self.ttl = ttl
+        self.cache_size = cache_size
+        # key -> [state, data, updated_at]
+        self._records = OrderedDict()
+        self._dirty = set()
+        self._flush_task = None
+        self._last_cleanup = 0.0
+
+    @staticmethod
+    def _key(key):
+        return ":".join(str(part or "") for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny,
+        ))
+
+    async def _record(self, key):
+        record = self._records.get(key)
+        if record is not None and record[2] > time.time() - self.ttl:
+            self._records.move_to_end(key)
+            return record
+        row = await get_fsm_record(key)
+        # Пока шёл запрос, запись могла появиться в памяти — она свежее строки из базы
+        record = self._records.get(key)
+        if record is not None and record[2] > time.time() - self.ttl:
+            return record
+        if row and row[2] > time.time() - self.ttl:
+            record = [row[0], json.loads(row[1]) if row[1] else {}, row[2]]
+        else:
+            record = [None, {}, time.time()]
+        self._records[key] = record
+        self._evict()
+        return record
+
+    def _evict(self):
+        while len(self._records) > self.cache_size:
+            for key in self._records:
+                if key not in self._dirty:
+                    del self._records[key]
+                    break
+            else:
+                return
+
+    def _touch(self, key, record):
+        record[2] = time.time()
+        self._dirty.add(key)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.flush_delay)
+        finally:
+            self._flush_task = None
+        try:
+            await self.flush()
+        except Exception:
+            # Ключи остались в _dirty и уйдут со следующей записью
+            logger.exception("Failed to flush FSM states")
+
+    async def flush(self):
+        if self._dirty:
+            keys, self._dirty = self._dirty, set()
+            upserts, deletes = [], []
+            for key in keys:
+                state, data, updated_at = self._records[key]
+                if state is None and not data:
+                    deletes.append(key)
+                else:
+                    upserts.append((key, state, json.dumps(data, ensure_ascii=False), int(updated_at)))
+            try:
+                await save_fsm_records(upserts, deletes)
+            except Exception:
+                self._dirty |= keys
+                raise
+        if time.time() - self._last_cleanup > CLEANUP_INTERVAL:
+            self._last_cleanup = time.time()
+            removed = await delete_expired_fsm_records(int(time.time() - self.ttl))
+            if removed:
+                logger.info("Removed %d abandoned FSM states", removed)
+
+    async def set_state(self, key, state=None):
+        key = self._key(key)
+        record = await self._record(key)
+        record[0] = state.state if isinstance(state, State) else state
+        self._touch(key, record)
+
+    async def get_state(self, key):
+        return (await self._record(self._key(key)))[0]
+
+    async def set_data(self, key, data):
+        key = self._key(key)
+        record = await self._record(key)
+        record[1] = dict(data)
+        self._touch(key, record)
+
+    async def get_data(self, key):
+        return dict((await self._record(self._key(key)))[1])
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
@@ -0,0 +1,104 @@
+import asyncio
+import hmac
+import logging
+import secrets
+import signal
+from aiohttp import web
+from pydantic import ValidationError
+from aiogram.types import Update
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_MAX_INFLIGHT,
+)
+
+DRAIN_TIMEOUT = 30
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    def __init__(self, dp, bot, secret=None, max_inflight=WEBHOOK_MAX_INFLIGHT):
+        self.dp = dp
+        self.bot = bot
+        # Без заданного секрета генерируем свой: он всё равно передаётся в set_webhook при старте
+        self.secret = secret or WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        self.max_inflight = max_inflight
+        self.draining = False
+        self._slots = asyncio.Semaphore(max_inflight)
+        self._tasks = set()
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle_update)
+        app.router.add_get("/health", self.handle_health)
+        return app
+
+    async def handle_update(self, request):
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token, self.secret):
+            return web.Response(status=401)
+        if self.draining:
+            # Telegram повторит доставку, когда бот поднимется снова
+            return web.Response(status=503)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except (ValueError, ValidationError) as e:
+            # 4xx Telegram не переотправляет, в отличие от 5xx
+            logger.warning("Rejected malformed update: %s", e)
+            return web.Response(status=400)
+        # Ответ Telegram задерживается, пока заняты все слоты — это и есть backpressure
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._release)
+        return web.Response()
+
+    def _release(self, task):
+        self._tasks.discard(task)
+        self._slots.release()
+
+    async def _process(self, update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            logger.exception("Failed to process update %s", update.update_id)
+
+    async def handle_health(self, request):
+        return web.json_response({
+            "status": "draining" if self.draining else "ok",
+            "inflight": len(self._tasks),
+            "max_inflight": self.max_inflight,
+        })
+
+    async def drain(self, timeout=DRAIN_TIMEOUT):
+        self.draining = True
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+
+async def run_webhook(dp, bot):
+    server = WebhookServer(dp, bot)
+    runner = web.AppRunner(server.create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    # Сначала слушаем порт, потом регистрируем вебхук: иначе первые обновления уйдут в никуда
+    await site.start()
+    logger.info("Webhook server listening on %s:%s%s", WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=server.secret,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=min(server.max_inflight, 100),
+            )
+        await stop.wait()
+    finally:
+        await server.drain()
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()